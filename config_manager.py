@@ -3,6 +3,9 @@ import os
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config', 'config.ini')
 
+# Sections in config.ini. Keys are exposed as "<SECTION>_<KEY>" in the settings dictionary.
+CONFIG_SECTIONS = ['PROXMOX', 'SSH', 'IMPORTER']
+
 # Define which keys are considered sensitive and should be prioritized from environment variables.
 SENSITIVE_KEYS = [
     "PROXMOX_HOST", "PROXMOX_USER", "PROXMOX_PASSWORD", "PROXMOX_TOKEN_ID", "PROXMOX_TOKEN_SECRET",
@@ -21,19 +24,17 @@ def load_config():
     # 1. Read the config.ini file (as a fallback)
     if os.path.exists(CONFIG_PATH):
         config.read(CONFIG_PATH)
-        if 'PROXMOX' in config:
-            for key in config['PROXMOX']:
-                settings[f"PROXMOX_{key.upper()}"] = config.get('PROXMOX', key)
-        if 'SSH' in config:
-            for key in config['SSH']:
-                settings[f"SSH_{key.upper()}"] = config.get('SSH', key)
+        for section in CONFIG_SECTIONS:
+            if section in config:
+                for key in config[section]:
+                    settings[f"{section}_{key.upper()}"] = config.get(section, key)
     else:
         # If config.ini doesn't exist, create an empty one with default structure
         # Ensure the config directory exists
         config_dir = os.path.dirname(CONFIG_PATH)
         os.makedirs(config_dir, exist_ok=True)
-        config['PROXMOX'] = {}
-        config['SSH'] = {}
+        for section in CONFIG_SECTIONS:
+            config[section] = {}
         with open(CONFIG_PATH, 'w') as configfile:
             config.write(configfile)
 
@@ -54,16 +55,15 @@ def save_config(data):
     # Initialize sections
     if os.path.exists(CONFIG_PATH):
         config.read(CONFIG_PATH)
-    if 'PROXMOX' not in config:
-        config['PROXMOX'] = {}
-    if 'SSH' not in config:
-        config['SSH'] = {}
+    for section in CONFIG_SECTIONS:
+        if section not in config:
+            config[section] = {}
 
     for key, value in data.items():
-        if key.startswith('PROXMOX_'):
-            config['PROXMOX'][key.replace('PROXMOX_', '').lower()] = value or ''
-        elif key.startswith('SSH_'):
-            config['SSH'][key.replace('SSH_', '').lower()] = value or ''
+        for section in CONFIG_SECTIONS:
+            if key.startswith(f"{section}_"):
+                config[section][key[len(section) + 1:].lower()] = value or ''
+                break
 
     # Ensure the config directory exists
     config_dir = os.path.dirname(CONFIG_PATH)
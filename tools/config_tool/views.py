@@ -1,7 +1,10 @@
 from flask import Blueprint, render_template, request, jsonify
 from config_manager import load_config, save_config
 # CHANGE: Import the new, specific test functions
-from tools.utils.shared_utils import clear_cache, test_api_connection, test_ssh_connection
+from tools.utils.shared_utils import clear_cache, test_api_connection, test_ssh_connection, connect_ssh_client
+from tools.utils.ssh_tuning import (
+    get_tuning_report, get_transfer_profile, run_ssh_tuning, reset_tuning_profile, supported_ciphers
+)
 
 config_tool_bp = Blueprint(
     'config_tool',
@@ -13,7 +16,7 @@ config_tool_bp = Blueprint(
 def config_tool():
     """Renders the HTML partial for the configuration tool."""
     current_config = load_config()
-    return render_template('config.html', config=current_config)
+    return render_template('config.html', config=current_config, ssh_ciphers=supported_ciphers())
 
 # --- NEW ROUTES BELOW ---
 @config_tool_bp.route('/test-api-config', methods=['POST'])
@@ -30,6 +33,32 @@ def test_ssh_config_route():
     is_success, message = test_ssh_connection(data)
     return jsonify({"success": is_success, "message": message})
 
+@config_tool_bp.route('/ssh-tuning-report')
+def ssh_tuning_report_route():
+    """Returns the saved SSH tuning profiles and the profile currently used for transfers."""
+    try:
+        active_profile = get_transfer_profile(load_config())
+    except ValueError as e:
+        active_profile = {'error': str(e)}
+    return jsonify({"success": True, "profiles": get_tuning_report(), "active_profile": active_profile})
+
+@config_tool_bp.route('/ssh-tuning/run', methods=['POST'])
+def run_ssh_tuning_route():
+    """Runs SSH tuning now for the host in the submitted form, replacing any saved profile."""
+    data = request.json
+    try:
+        profile = run_ssh_tuning(data, connect_ssh_client)
+        return jsonify({"success": True, "message": f"Tuning completed: {profile['cipher']} at {profile['throughput_mb_per_s']} MB/s.", "profile": profile})
+    except Exception as e:
+        print(f"Error during SSH tuning: {e}")
+        return jsonify({"success": False, "message": f"SSH tuning failed: {e}"})
+
+@config_tool_bp.route('/ssh-tuning/reset', methods=['POST'])
+def reset_ssh_tuning_route():
+    """Deletes the saved SSH tuning profile for the host in the submitted form."""
+    reset_tuning_profile(request.json)
+    return jsonify({"success": True, "message": "SSH tuning profile removed. Default settings are used until the host is tuned again."})
+
 
 @config_tool_bp.route('/save-config', methods=['POST'])
 def save_config_route():
@@ -3,24 +3,86 @@ import time
 import re
 from flask import Blueprint, request, render_template, Response, jsonify, url_for, session
 from threading import Thread
-import subprocess
-import shutil
 import socket
 import queue
+import zipfile
 import paramiko
+from urllib.parse import quote
+from werkzeug.formparser import parse_form_data
 
 from tools.utils.shared_utils import (
     get_cached_proxmox_api_and_ssh_data,
     execute_ssh_command_streamed,
     log_progress,
+    clear_progress_messages,
     progress_queues,
-    get_ssh_client
+    get_ssh_client,
+    wait_for_proxmox_task
+)
+from tools.utils.vmid_index import (
+    VMID_MIN,
+    VMID_MAX,
+    refresh_vm_id_index,
+    get_vm_id_summary,
+    reserve_vm_ids,
+    release_vm_id_reservation,
+    claim_vm_id,
+    is_vm_id_used,
+    mark_vm_id_used
+)
+from tools.utils.proxmox_upload import (
+    TRANSPORT_SSH,
+    TRANSPORT_HTTP,
+    select_transport,
+    upload_image_via_api,
+    get_import_volume_id,
+    record_transfer_throughput,
+    transport_attempt,
+    get_transfer_stats
+)
+from tools.utils.replication import (
+    get_cluster_node_ips,
+    get_ssh_host_node,
+    is_shared_storage,
+    run_on_node,
+    copy_to_node,
+    get_volume_path,
+    update_node_status,
+    reset_node_statuses,
+    get_node_statuses
+)
+from tools.utils.image_library import (
+    HashingUploadFile,
+    add_zip_to_library,
+    get_library_image,
+    get_library_image_dir,
+    list_library_images,
+    get_library_usage,
+    acquire_library_image,
+    release_library_image,
+    delete_library_image,
+    enforce_library_size_limit,
+    get_library_max_bytes
+)
+from tools.utils.transfer_scheduler import (
+    DEFAULT_PRIORITY,
+    TransferJob,
+    get_destination_host,
+    get_active_transfers
+)
+from tools.utils.scratch_manager import (
+    reserve_scratch_space,
+    release_scratch_space,
+    get_zip_extracted_size,
+    get_scratch_usage,
+    start_scratch_sweeper
 )
 from proxmoxer import ProxmoxAPI, core
 from config_manager import load_config
 
 SESSION_QCOW_FILES_KEY = 'uploaded_qcow_files'
-SESSION_LOCAL_ZIP_PATH_KEY = 'local_zip_file_path'
+SESSION_IMAGE_HASH_KEY = 'library_image_hash'
+SESSION_IMAGE_HOLDER_KEY = 'library_image_holder'
 
 proxmox_vm_importer_bp = Blueprint(
     'proxmox_vm_importer',
@@ -28,6 +90,9 @@ proxmox_vm_importer_bp = Blueprint(
     template_folder='templates'
 )
 
+# Orphaned uploads and progress logs are swept in the background in every worker.
+proxmox_vm_importer_bp.record_once(lambda state: start_scratch_sweeper(load_config))
+
 # CHANGE: The redundant '/' route has been removed here.
 
 @proxmox_vm_importer_bp.route('/tool/proxmox-importer')
@@ -46,7 +111,7 @@ def proxmox_importer_tool():
             return render_template(
                 'proxmox_importer.html',
                 nodes=[],
-                used_vm_ids=[],
+                vm_id_summary=None,
                 storage_locations=[],
                 connection_error=f"Proxmox configuration incomplete. Missing: {', '.join(missing_settings)}. Please configure these settings in the Configuration tool."
             )
@@ -57,20 +122,20 @@ def proxmox_importer_tool():
             return render_template(
                 'proxmox_importer.html',
                 nodes=[],
-                used_vm_ids=[],
+                vm_id_summary=None,
                 storage_locations=[],
                 connection_error=error_message or "Proxmox connection failed. Please check your configuration."
             )
         
         # If we get here, connection is working - get the data
         nodes_data = []
-        used_vm_ids = []
+        vm_id_summary = None
         storage_locations_names = []
         
         try:
             nodes_list = proxmox_api.nodes.get()
-            vms = proxmox_api.cluster.resources.get(type='vm')
-            used_vm_ids = sorted([vm['vmid'] for vm in vms])
+            refresh_vm_id_index(proxmox_api)
+            vm_id_summary = get_vm_id_summary()
             temp_storage_locations = []
             for node in nodes_list:
                 node_name = node['node']
@@ -89,7 +154,7 @@ def proxmox_importer_tool():
             return render_template(
                 'proxmox_importer.html',
                 nodes=[],
-                used_vm_ids=[],
+                vm_id_summary=None,
                 storage_locations=[],
                 connection_error=f"Failed to retrieve Proxmox data: {str(e)}"
             )
@@ -97,61 +162,135 @@ def proxmox_importer_tool():
         return render_template(
             'proxmox_importer.html',
             nodes=nodes_data,
-            used_vm_ids=used_vm_ids,
-            storage_locations=storage_locations_names
+            vm_id_summary=vm_id_summary,
+            storage_locations=storage_locations_names,
+            library_images=list_library_images(),
+            scratch_usage=get_scratch_usage(config)
         )
         
     except Exception as e:
         return render_template(
             'proxmox_importer.html',
             nodes=[],
-            used_vm_ids=[],
+            vm_id_summary=None,
             storage_locations=[],
             connection_error=f"Configuration error: {str(e)}"
         )
 
+def _get_upload_folder():
+    upload_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'temp_uploads')
+    os.makedirs(upload_folder, exist_ok=True)
+    return upload_folder
+
+def _use_library_image(session_id, image_hash):
+    """Holds a library image for this session and stores it in the user session."""
+    metadata = acquire_library_image(image_hash, session_id)
+    previous_hash = session.get(SESSION_IMAGE_HASH_KEY)
+    previous_session_id = session.get(SESSION_IMAGE_HOLDER_KEY)
+    if previous_hash and previous_session_id and previous_session_id != session_id:
+        release_library_image(previous_hash, previous_session_id)
+    session[SESSION_QCOW_FILES_KEY] = metadata['qcow_files']
+    session[SESSION_IMAGE_HASH_KEY] = image_hash
+    session[SESSION_IMAGE_HOLDER_KEY] = session_id
+    return metadata
+
 @proxmox_vm_importer_bp.route('/upload-and-extract-zip', methods=['POST'])
 def upload_and_extract_zip():
     session_id = int(time.time())
-    file_storage_obj = request.files.get('zipfile')
-    if not file_storage_obj:
-        return jsonify({"success": False, "error": "No ZIP file uploaded."})
+    config = load_config()
+    if not request.content_length:
+        return jsonify({"success": False, "error": "The upload size is unknown (missing Content-Length)."})
 
-    local_zip_file_path = None
-    unzip_dir = None
-    try:
-        UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'temp_uploads')
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-        local_zip_file_path = os.path.join(UPLOAD_FOLDER, f"{session_id}_{file_storage_obj.filename}")
-        file_storage_obj.save(local_zip_file_path)
+    # Space is reserved before the request body is read, so uploads that do not fit are refused up front.
+    scratch_token = None
+    upload_folder = _get_upload_folder()
+    upload_files = []
+
+    def spool_upload(total_content_length, content_type, filename, content_length=None):
+        # The body is parsed straight into the scratch folder instead of a temporary file, so it is stored once.
+        upload_file = HashingUploadFile(os.path.join(upload_folder, f"{session_id}_{os.path.basename(filename or 'upload')}"))
+        upload_files.append(upload_file)
+        return upload_file
 
-        unzip_executable = shutil.which('unzip')
-        if not unzip_executable:
-            raise RuntimeError("The 'unzip' command was not found on the local server.")
+    try:
+        scratch_token = reserve_scratch_space(config, request.content_length, f"upload_{session_id}")
+        _, _, files = parse_form_data(request.environ, stream_factory=spool_upload)
+        file_storage_obj = files.get('zipfile')
+        if not file_storage_obj:
+            return jsonify({"success": False, "error": "No ZIP file uploaded."})
 
-        unzip_dir = os.path.join(UPLOAD_FOLDER, f"_tmp_proxmox_importer_{session_id}")
-        os.makedirs(unzip_dir, exist_ok=True)
-        unzip_command_local = [
-            unzip_executable, "-o", "-qq", local_zip_file_path, "-d", unzip_dir
-        ]
-        subprocess.run(unzip_command_local, check=True, capture_output=True, text=True)
+        file_storage_obj.stream.close()
+        local_zip_file_path = file_storage_obj.stream.name
+        image_hash = file_storage_obj.stream.hexdigest()
 
-        qcow_files_local = sorted([f for f in os.listdir(unzip_dir) if f.lower().endswith(('.qcow2', '.qcow'))])
-        if not qcow_files_local:
-            raise ValueError("No .qcow2 or .qcow files found in the ZIP archive.")
+        if get_library_image(image_hash):
+            message = "ZIP successfully uploaded. The image was already in the library."
+        else:
+            try:
+                extracted_size = get_zip_extracted_size(local_zip_file_path)
+            except zipfile.BadZipFile:
+                raise ValueError("The uploaded file is not a valid ZIP archive.")
+            # The archive stays on disk until the extraction has finished.
+            reserve_scratch_space(
+                config, os.path.getsize(local_zip_file_path) + extracted_size, f"upload_{session_id}", token=scratch_token
+            )
+            unzip_dir = os.path.join(upload_folder, f"_tmp_proxmox_importer_{session_id}")
+            add_zip_to_library(local_zip_file_path, image_hash, file_storage_obj.filename, unzip_dir)
+            message = "ZIP successfully uploaded and extracted."
 
-        session[SESSION_QCOW_FILES_KEY] = qcow_files_local
-        session[SESSION_LOCAL_ZIP_PATH_KEY] = local_zip_file_path
+        metadata = _use_library_image(session_id, image_hash)
+        enforce_library_size_limit(get_library_max_bytes(config))
 
         return jsonify({
             "success": True, 
-            "qcow_files": qcow_files_local, 
+            "qcow_files": metadata['qcow_files'], 
+            "session_id": session_id,
+            "message": message
+        })
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+    finally:
+        for upload_file in upload_files:
+            upload_file.close()
+            if os.path.exists(upload_file.name): os.remove(upload_file.name)
+        release_scratch_space(scratch_token)
+
+@proxmox_vm_importer_bp.route('/scratch-usage')
+def scratch_usage():
+    """Returns the scratch space quota, reservations and current disk usage."""
+    try:
+        return jsonify({"success": True, "usage": get_scratch_usage(load_config())})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+@proxmox_vm_importer_bp.route('/image-library')
+def image_library():
+    """Lists the images in the local image library."""
+    return jsonify({"success": True, "images": list_library_images(), "usage": get_library_usage()})
+
+@proxmox_vm_importer_bp.route('/image-library/select', methods=['POST'])
+def select_library_image():
+    """Starts an import session from a library image, without uploading a file."""
+    session_id = int(time.time())
+    image_hash = (request.json or {}).get('image_hash')
+    try:
+        metadata = _use_library_image(session_id, image_hash)
+        return jsonify({
+            "success": True,
+            "qcow_files": metadata['qcow_files'],
             "session_id": session_id,
-            "message": "ZIP successfully uploaded and extracted."
+            "message": f"Using '{metadata['name']}' from the image library."
         })
     except Exception as e:
-        if local_zip_file_path and os.path.exists(local_zip_file_path): os.remove(local_zip_file_path)
-        if unzip_dir and os.path.exists(unzip_dir): shutil.rmtree(unzip_dir)
+        return jsonify({"success": False, "error": str(e)})
+
+@proxmox_vm_importer_bp.route('/image-library/delete', methods=['POST'])
+def delete_image_from_library():
+    image_hash = (request.json or {}).get('image_hash')
+    try:
+        delete_library_image(image_hash)
+        return jsonify({"success": True, "message": "Image removed from the library."})
+    except Exception as e:
         return jsonify({"success": False, "error": str(e)})
 
 @proxmox_vm_importer_bp.route('/get-network-bridges/<node_name>')
@@ -167,6 +306,36 @@ def get_network_bridges(node_name):
         print(f"Error retrieving bridges for node '{node_name}': {e}")
         return jsonify([]), 500
 
+@proxmox_vm_importer_bp.route('/vm-ids/next-free', methods=['GET', 'POST'])
+def next_free_vm_ids():
+    """Returns the next free VM IDs in a range. A POST also reserves them."""
+    proxmox_api, _, _, is_error, error_message = get_cached_proxmox_api_and_ssh_data()
+    if is_error or not proxmox_api:
+        return jsonify({"success": False, "error": error_message or "Proxmox connection failed."}), 500
+    try:
+        count = min(request.args.get('count', 1, type=int), 100)
+        range_start = request.args.get('start', VMID_MIN, type=int)
+        range_end = request.args.get('end', VMID_MAX, type=int)
+        token, vm_ids = reserve_vm_ids(proxmox_api, count, range_start, range_end, reserve=request.method == 'POST')
+        return jsonify({
+            "success": True,
+            "vm_ids": vm_ids,
+            "reservation_token": token,
+            "summary": get_vm_id_summary()
+        })
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        print(f"Error retrieving free VM IDs: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@proxmox_vm_importer_bp.route('/vm-ids/release', methods=['POST'])
+def release_vm_ids():
+    """Releases a VM ID reservation that is no longer needed."""
+    token = (request.json or {}).get('reservation_token')
+    release_vm_id_reservation(token)
+    return jsonify({"success": True})
+
 @proxmox_vm_importer_bp.route('/finalize-vm-import', methods=['POST'])
 def finalize_vm_import():
     vm_data_json = request.json
@@ -174,13 +343,39 @@ def finalize_vm_import():
     if not session_id:
         return jsonify({"success": False, "error": "Session ID is missing."})
 
+    vm_id = vm_data_json.get('vm_id')
+    reservation_token = vm_data_json.get('vm_id_reservation')
+    try:
+        proxmox_api, _, _, is_error, _ = get_cached_proxmox_api_and_ssh_data()
+        if not is_error and proxmox_api:
+            refresh_vm_id_index(proxmox_api, force=True)
+        if is_vm_id_used(vm_id):
+            return jsonify({"success": False, "error": f"VM ID {vm_id} is already in use."})
+        # Typed-in IDs are reserved here as well, so no other import can be handed the same ID.
+        reservation_token = claim_vm_id(vm_id, reservation_token)
+        if not reservation_token:
+            return jsonify({"success": False, "error": f"VM ID {vm_id} is reserved by another import. Please pick a different ID."})
+        vm_data_json['vm_id_reservation'] = reservation_token
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": f"Invalid VM ID: {vm_id}"})
+
+    # A retry after a failed import starts with a clean progress log and replication status.
+    clear_progress_messages(session_id)
+    if vm_data_json.get('replica_nodes'):
+        reset_node_statuses(session_id)
     progress_queues[session_id] = queue.Queue()
     log_progress(session_id, "--- Starting VM import finalization ---")
     
-    local_zip_file_path = session.get(SESSION_LOCAL_ZIP_PATH_KEY)
-    if not local_zip_file_path:
-        log_progress(session_id, "❌ ERROR: Session has expired or the ZIP path could not be found. Please start over.")
+    image_hash = session.get(SESSION_IMAGE_HASH_KEY)
+    if not image_hash or not get_library_image(image_hash):
+        log_progress(session_id, "❌ ERROR: Session has expired or the disk image could not be found. Please start over.")
+        release_vm_id_reservation(reservation_token)
         return jsonify({"success": False, "error": "Session expired"})
+    # The import task holds its own reference for as long as it runs. The reference taken at upload
+    # or selection is dropped, so the image can be evicted or removed once the import has finished.
+    # The hash stays in the session, so a failed import can be retried while the image is in the library.
+    acquire_library_image(image_hash, f"import_{session_id}")
+    release_library_image(image_hash, session.pop(SESSION_IMAGE_HOLDER_KEY, None))
 
     # Initialize progress queue for this session
     if session_id not in progress_queues:
@@ -189,11 +384,29 @@ def finalize_vm_import():
     # Send initial progress message
     log_progress(session_id, "🚀 Starting VM import process...")
     
-    thread = Thread(target=_perform_full_vm_import_task, args=(session_id, vm_data_json, local_zip_file_path))
+    thread = Thread(target=_perform_full_vm_import_task, args=(session_id, vm_data_json, image_hash))
     thread.start()
 
     return jsonify({"success": True, "message": "VM import process started. Follow the progress."})
 
+@proxmox_vm_importer_bp.route('/replication-status/<int:session_id>')
+def replication_status(session_id):
+    """Returns the per-node progress of a replicated import."""
+    return jsonify(get_node_statuses(session_id))
+
+@proxmox_vm_importer_bp.route('/transfers')
+def active_transfers():
+    """Returns the running uploads per destination host, with their bandwidth share and achieved rate."""
+    try:
+        return jsonify({"success": True, "transfers": get_active_transfers()})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+@proxmox_vm_importer_bp.route('/transfer-stats')
+def transfer_stats():
+    """Returns the measured throughput per node/storage and transport that transport selection is based on."""
+    return jsonify({"success": True, "stats": get_transfer_stats()})
+
 @proxmox_vm_importer_bp.route('/progress/<int:session_id>')
 def progress(session_id):
     def generate():
@@ -235,7 +448,129 @@ def progress(session_id):
                        'Access-Control-Allow-Headers': 'Cache-Control'
                    })
 
-def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
+REPLICATION_SHARED = 'shared storage'
+REPLICATION_CLUSTER = 'node-to-node'
+REPLICATION_DIRECT = 'direct upload'
+
+def _select_replication_mode(config, proxmox_api, seed_node, storage, transport):
+    """Chooses how replica nodes get the disk images. Returns a (mode, reason) tuple."""
+    if transport == TRANSPORT_HTTP and is_shared_storage(proxmox_api, seed_node, storage):
+        return REPLICATION_SHARED, f"'{storage}' is shared, replicas import the uploaded images directly"
+    if transport == TRANSPORT_SSH or (config.get('SSH_USERNAME') and config.get('SSH_AUTH_METHOD')):
+        return REPLICATION_CLUSTER, "images are copied from the seed node over the cluster network"
+    return REPLICATION_DIRECT, "SSH is not configured, images are uploaded to each node separately"
+
+def _create_vm(proxmox_api, node, vm_config, session_id):
+    upid = proxmox_api.nodes(node).qemu.post(**vm_config)
+    if upid:
+        wait_for_proxmox_task(proxmox_api, node, upid, session_id=session_id)
+
+def _update_vm_config(proxmox_api, node, vm_id, session_id, **options):
+    """Changes the VM configuration and waits for the task, e.g. when disks are allocated or imported."""
+    upid = proxmox_api.nodes(node).qemu(vm_id).config.post(**options)
+    if upid:
+        wait_for_proxmox_task(proxmox_api, node, upid, session_id=session_id)
+
+def _parse_imported_volume_id(import_output, filename):
+    vol_id_match = re.search(r"successfully imported disk '([^']+)'", import_output, re.IGNORECASE)
+    if not vol_id_match: raise RuntimeError(f"Could not find Volume ID for '{filename}'. Output: {import_output}")
+    return vol_id_match.group(1)
+
+def _copy_to_node_scheduled(job, session_id, node, node_ip, source_path, target_dir, copy_size):
+    """Copies files from the seed node to a replica node within the bandwidth share for that node."""
+    # rsync runs on the seed node and cannot change its --bwlimit, so the share is fixed when the copy starts.
+    with TransferJob(job['config'], node_ip, f"{session_id} {node}: copy", job['priority'], fixed_rate=True) as transfer:
+        copy_to_node(
+            job['ssh_client'], source_path, node_ip, target_dir, session_id, log_prefix=f"[{node}] Copy",
+            bwlimit=transfer.share, source_node_ip=job['seed_ip'] if job['transport'] == TRANSPORT_HTTP else None
+        )
+        transfer.consume(copy_size, throttle=False)
+    log_progress(session_id, f"[{node}] Copied {copy_size / (1024 * 1024):.1f} MB ({transfer.describe()}).")
+
+def _replicate_to_node(session_id, node, replica_vm_id, job):
+    """Creates a copy of the imported VM on another node. Runs in its own thread, one per replica node."""
+    proxmox_api = job['proxmox_api']
+    ssh_client = job['ssh_client']
+    storage = job['storage']
+    node_ip = job['node_ips'].get(node)
+    log_prefix = f"[{node}]"
+    node_import_volumes = []
+    copied_temp_dir = False
+
+    try:
+        if job['mode'] == REPLICATION_CLUSTER and not node_ip:
+            raise RuntimeError(f"No cluster IP address found for node '{node}'.")
+
+        update_node_status(session_id, node, vm_id=replica_vm_id, state='creating')
+        vm_config = dict(job['vm_config'], vmid=replica_vm_id, name=f"{job['vm_config']['name']}-{node}")
+        _create_vm(proxmox_api, node, vm_config, session_id)
+        mark_vm_id_used(replica_vm_id)
+        log_progress(session_id, f"{log_prefix} ✅ VM '{vm_config['name']}' ({replica_vm_id}) created.")
+
+        # With SSH transport the images are in the temporary directory on the SSH host, so that node
+        # already has them. Its directory is removed by the import task, not by this replica.
+        if job['mode'] == REPLICATION_CLUSTER and job['transport'] == TRANSPORT_SSH and job['uploaded_disks'] and node != job['ssh_node']:
+            update_node_status(session_id, node, state='copying')
+            copy_size = sum(os.path.getsize(os.path.join(job['local_dir'], disk['filename'])) for disk in job['uploaded_disks'])
+            _copy_to_node_scheduled(job, session_id, node, node_ip, job['remote_temp_dir'] + '/', job['remote_temp_dir'], copy_size)
+            copied_temp_dir = True
+
+        for disk in job['uploaded_disks']:
+            filename = disk['filename']
+            scsi_id = disk['scsi_id']
+            if job['mode'] == REPLICATION_CLUSTER and job['transport'] == TRANSPORT_SSH:
+                update_node_status(session_id, node, state='importing')
+                import_cmd = f"qm importdisk {replica_vm_id} {disk['remote_path']} {storage}"
+                import_output = run_on_node(ssh_client, node_ip, import_cmd, session_id, log_prefix=f"{log_prefix} Import '{filename}'")
+                _update_vm_config(proxmox_api, node, replica_vm_id, session_id, **{scsi_id: _parse_imported_volume_id(import_output, filename)})
+            else:
+                import_volume_id = disk['import_volume_id']
+                if job['mode'] == REPLICATION_CLUSTER:
+                    update_node_status(session_id, node, state='copying')
+                    copy_size = os.path.getsize(os.path.join(job['local_dir'], filename))
+                    _copy_to_node_scheduled(job, session_id, node, node_ip, disk['source_path'], os.path.dirname(disk['source_path']), copy_size)
+                    node_import_volumes.append(import_volume_id)
+                elif job['mode'] == REPLICATION_DIRECT:
+                    update_node_status(session_id, node, state='uploading')
+                    local_path = os.path.join(job['local_dir'], filename)
+                    upload_host = get_destination_host(job['config'])
+                    with TransferJob(job['config'], upload_host, f"{session_id} {node}: {filename}", job['priority']) as transfer:
+                        upload_upid = upload_image_via_api(
+                            job['config'], node, storage, local_path, import_volume_id.split('/', 1)[1],
+                            callback=transfer.wrap_callback()
+                        )
+                    log_progress(session_id, f"{log_prefix} '{filename}' uploaded ({transfer.describe()}).")
+                    if upload_upid:
+                        wait_for_proxmox_task(proxmox_api, node, upload_upid, session_id=session_id)
+                    node_import_volumes.append(import_volume_id)
+                update_node_status(session_id, node, state='importing')
+                _update_vm_config(proxmox_api, node, replica_vm_id, session_id, **{scsi_id: f"{storage}:0,import-from={import_volume_id}"})
+            log_progress(session_id, f"{log_prefix} ✅ Disk '{filename}' attached to {scsi_id}.")
+
+        for disk in job['additional_disks']:
+            if not disk['scsi_id'] or not disk['size']: continue
+            _update_vm_config(proxmox_api, node, replica_vm_id, session_id, **{disk['scsi_id']: f"{storage}:{disk['size']}"})
+        if job['boot_disk_scsi_id']:
+            proxmox_api.nodes(node).qemu(replica_vm_id).config.put(boot=f"order={job['boot_disk_scsi_id']}")
+
+        update_node_status(session_id, node, state='done')
+        log_progress(session_id, f"{log_prefix} ✅ Replica completed.")
+    except Exception as e:
+        update_node_status(session_id, node, state='failed', message=str(e))
+        log_progress(session_id, f"{log_prefix} ⚠️ Replication failed: {e}")
+    finally:
+        if copied_temp_dir:
+            try:
+                run_on_node(ssh_client, node_ip, f"rm -rf {job['remote_temp_dir']}", session_id, log_prefix=f"{log_prefix} Cleanup", allow_failure=True)
+            except Exception as e:
+                log_progress(session_id, f"{log_prefix} ⚠️ Error during remote cleanup: {e}.")
+        for import_volume_id in node_import_volumes:
+            try:
+                proxmox_api.nodes(node).storage(storage).content(quote(import_volume_id, safe='')).delete()
+            except Exception as e:
+                log_progress(session_id, f"{log_prefix} ⚠️ Error removing uploaded image '{import_volume_id}': {e}.")
+
+def _perform_full_vm_import_task(session_id, vm_data, image_hash):
     """The full import task that runs in a separate thread."""
     
     vm_id = vm_data.get('vm_id')
@@ -248,10 +583,17 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
     uploaded_disks = vm_data.get('uploaded_disks', [])
     additional_disks = vm_data.get('additional_disks', [])
     network_adapters = vm_data.get('network_adapters', [])
+    vm_id_reservation = vm_data.get('vm_id_reservation')
+    transfer_priority = vm_data.get('transfer_priority') or DEFAULT_PRIORITY
+    replica_nodes = [node for node in vm_data.get('replica_nodes', []) if node and node != proxmox_node]
     
     PROXMOX_REMOTE_TEMP_DIR = f"/tmp/fortitoolbox_{session_id}"
-    local_unzipped_qcow_dir = os.path.join(os.path.dirname(local_zip_file_path), f"_tmp_proxmox_importer_{session_id}")
+    local_unzipped_qcow_dir = get_library_image_dir(image_hash)
     ssh_client = None
+    task_proxmox = None
+    uploaded_import_volumes = []
+    replica_reservation = None
+    seed_completed = False
 
     try:
         log_progress(session_id, "Step A: Validation and preparation.")
@@ -259,12 +601,36 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
         if is_error: raise RuntimeError(f"Environment checks failed: {err_msg}")
         if not unzip_available: raise RuntimeError("The 'unzip' command is not available on the Proxmox server.")
         
-        log_progress(session_id, "Step B: Establishing SSH connection.")
         current_config = load_config()
-        ssh_client = get_ssh_client(current_config)
-        log_progress(session_id, "✅ SSH connection established successfully.")
+        transport, transport_reason = TRANSPORT_SSH, "no uploaded disks"
+        if uploaded_disks:
+            transport, transport_reason = select_transport(
+                current_config, task_proxmox, proxmox_node, proxmox_storage_target,
+                [disk['filename'] for disk in uploaded_disks]
+            )
+        log_progress(session_id, f"Transport for disk images: {transport.upper()} ({transport_reason}).")
+
+        replication_mode = None
+        if replica_nodes:
+            replication_mode, replication_reason = _select_replication_mode(
+                current_config, task_proxmox, proxmox_node, proxmox_storage_target, transport
+            )
+            log_progress(session_id, f"Replication to {', '.join(replica_nodes)}: {replication_mode} ({replication_reason}).")
+            update_node_status(session_id, proxmox_node, role='seed', vm_id=vm_id, state='pending')
+            for node in replica_nodes:
+                update_node_status(session_id, node, role='replica', state='pending')
+
+        if transport == TRANSPORT_SSH or (replication_mode == REPLICATION_CLUSTER and uploaded_disks):
+            log_progress(session_id, "Step B: Establishing SSH connection.")
+            with transport_attempt(proxmox_node, proxmox_storage_target, TRANSPORT_SSH):
+                ssh_client = get_ssh_client(current_config, tune=True, session_id=session_id)
+            log_progress(session_id, "✅ SSH connection established successfully.")
+        else:
+            log_progress(session_id, "Step B: Skipping SSH, disk images are uploaded through the Proxmox API.")
         
         log_progress(session_id, "Step C: Creating VM.")
+        if replica_nodes:
+            update_node_status(session_id, proxmox_node, state='creating')
         vm_config = {
             'vmid': vm_id, 'name': vm_name, 'memory': memory, 'cores': cores,
             'ostype': ostype, 'scsihw': 'virtio-scsi-pci',
@@ -279,15 +645,20 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
                 net_config += f",tag={vlan_tag}"
             vm_config[f'net{net_id}'] = net_config
         
-        task_proxmox.nodes(proxmox_node).qemu.post(**vm_config)
+        _create_vm(task_proxmox, proxmox_node, vm_config, session_id)
+        mark_vm_id_used(vm_id)
+        release_vm_id_reservation(vm_id_reservation)
         log_progress(session_id, f"✅ VM '{vm_name}' created successfully.")
 
         log_progress(session_id, "Step D: Importing and attaching uploaded disks.")
         boot_disk_scsi_id = None
         if uploaded_disks:
             log_progress(session_id, f"--- Copying uploaded files to Proxmox ---")
+            if replica_nodes:
+                update_node_status(session_id, proxmox_node, state='uploading')
+            upload_host = get_destination_host(current_config)
             
-            # Helper for SFTP progress
+            # Helper for upload progress
             class ProgressTracker:
                 def __init__(self, total_size, session_id, filename):
                     self.total_size = total_size
@@ -305,39 +676,72 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
                             log_progress(self.session_id, f"    Uploading '{self.filename}': {percent}%")
                             self.last_reported_percent = percent
 
-            with ssh_client.open_sftp() as sftp_client:
-                sftp_client.mkdir(PROXMOX_REMOTE_TEMP_DIR)
+            if transport == TRANSPORT_HTTP:
                 for disk in uploaded_disks:
                     filename = disk['filename']
+                    scsi_id = disk['scsi_id']
                     local_path = os.path.join(local_unzipped_qcow_dir, filename)
-                    remote_path = os.path.join(PROXMOX_REMOTE_TEMP_DIR, filename)
-                    
+                    remote_filename = f"fortitoolbox_{session_id}_{filename}"
                     file_size = os.path.getsize(local_path)
-                    progress_callback = ProgressTracker(file_size, session_id, filename)
-                    
-                    sftp_client.put(local_path, remote_path, callback=progress_callback)
-                    log_progress(session_id, f"✅ '{filename}' copied successfully.")
-            
-            for disk in uploaded_disks:
-                filename = disk['filename']
-                scsi_id = disk['scsi_id']
-                remote_path = os.path.join(PROXMOX_REMOTE_TEMP_DIR, filename)
-                log_progress(session_id, f"--- Importing: '{filename}' to '{proxmox_storage_target}' ---")
-                import_cmd = f"qm importdisk {vm_id} {remote_path} {proxmox_storage_target}"
-                import_output = execute_ssh_command_streamed(ssh_client, import_cmd, session_id, log_prefix=f"Import '{filename}'")
-
-                vol_id_match = re.search(r"successfully imported disk '([^']+)'", import_output, re.IGNORECASE)
-                if not vol_id_match: raise RuntimeError(f"Could not find Volume ID for '{filename}'. Output: {import_output}")
-                volume_id = vol_id_match.group(1)
-                log_progress(session_id, f"✅ Disk '{filename}' imported as '{volume_id}'.")
-
-                log_progress(session_id, f"--- Attaching '{volume_id}' to {scsi_id} ---")
-                attach_cmd = f"qm set {vm_id} --{scsi_id} {volume_id}"
-                execute_ssh_command_streamed(ssh_client, attach_cmd, session_id, log_prefix=f"Attach '{filename}'")
-                log_progress(session_id, f"✅ Disk successfully attached to {scsi_id}.")
-
-                if disk.get('is_boot'):
-                    boot_disk_scsi_id = disk['scsi_id']
+
+                    start_time = time.monotonic()
+                    with transport_attempt(proxmox_node, proxmox_storage_target, TRANSPORT_HTTP):
+                        with TransferJob(current_config, upload_host, f"{session_id}: {filename}", transfer_priority) as transfer:
+                            upload_upid = upload_image_via_api(
+                                current_config, proxmox_node, proxmox_storage_target, local_path, remote_filename,
+                                callback=transfer.wrap_callback(ProgressTracker(file_size, session_id, filename))
+                            )
+                        if upload_upid:
+                            wait_for_proxmox_task(task_proxmox, proxmox_node, upload_upid, session_id=session_id)
+                    # Time spent throttled is left out, so the stats describe the link and not the bandwidth limit.
+                    record_transfer_throughput(proxmox_node, proxmox_storage_target, TRANSPORT_HTTP, file_size, time.monotonic() - start_time - transfer.throttled_seconds)
+                    import_volume_id = get_import_volume_id(proxmox_storage_target, remote_filename)
+                    uploaded_import_volumes.append(import_volume_id)
+                    disk['import_volume_id'] = import_volume_id
+                    log_progress(session_id, f"✅ '{filename}' uploaded as '{import_volume_id}' ({transfer.describe()}).")
+
+                    log_progress(session_id, f"--- Importing '{import_volume_id}' to '{proxmox_storage_target}' and attaching to {scsi_id} ---")
+                    _update_vm_config(task_proxmox, proxmox_node, vm_id, session_id, **{scsi_id: f"{proxmox_storage_target}:0,import-from={import_volume_id}"})
+                    log_progress(session_id, f"✅ Disk successfully imported and attached to {scsi_id}.")
+
+                    if disk.get('is_boot'):
+                        boot_disk_scsi_id = disk['scsi_id']
+            else:
+                with transport_attempt(proxmox_node, proxmox_storage_target, TRANSPORT_SSH), ssh_client.open_sftp() as sftp_client:
+                    sftp_client.mkdir(PROXMOX_REMOTE_TEMP_DIR)
+                    for disk in uploaded_disks:
+                        filename = disk['filename']
+                        local_path = os.path.join(local_unzipped_qcow_dir, filename)
+                        remote_path = os.path.join(PROXMOX_REMOTE_TEMP_DIR, filename)
+                        disk['remote_path'] = remote_path
+                        
+                        file_size = os.path.getsize(local_path)
+                        progress_callback = ProgressTracker(file_size, session_id, filename)
+                        
+                        start_time = time.monotonic()
+                        with TransferJob(current_config, upload_host, f"{session_id}: {filename}", transfer_priority) as transfer:
+                            sftp_client.put(local_path, remote_path, callback=transfer.wrap_callback(progress_callback))
+                        record_transfer_throughput(proxmox_node, proxmox_storage_target, TRANSPORT_SSH, file_size, time.monotonic() - start_time - transfer.throttled_seconds)
+                        log_progress(session_id, f"✅ '{filename}' copied successfully ({transfer.describe()}).")
+                
+                for disk in uploaded_disks:
+                    filename = disk['filename']
+                    scsi_id = disk['scsi_id']
+                    remote_path = os.path.join(PROXMOX_REMOTE_TEMP_DIR, filename)
+                    log_progress(session_id, f"--- Importing: '{filename}' to '{proxmox_storage_target}' ---")
+                    import_cmd = f"qm importdisk {vm_id} {remote_path} {proxmox_storage_target}"
+                    import_output = execute_ssh_command_streamed(ssh_client, import_cmd, session_id, log_prefix=f"Import '{filename}'")
+
+                    volume_id = _parse_imported_volume_id(import_output, filename)
+                    log_progress(session_id, f"✅ Disk '{filename}' imported as '{volume_id}'.")
+
+                    log_progress(session_id, f"--- Attaching '{volume_id}' to {scsi_id} ---")
+                    attach_cmd = f"qm set {vm_id} --{scsi_id} {volume_id}"
+                    execute_ssh_command_streamed(ssh_client, attach_cmd, session_id, log_prefix=f"Attach '{filename}'")
+                    log_progress(session_id, f"✅ Disk successfully attached to {scsi_id}.")
+
+                    if disk.get('is_boot'):
+                        boot_disk_scsi_id = disk['scsi_id']
 
         log_progress(session_id, "Step E: Creating and attaching additional disks.")
         for disk in additional_disks:
@@ -345,8 +749,7 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
             size_gb = disk['size']
             if not scsi_id or not size_gb: continue
             log_progress(session_id, f"--- Creating new disk on {scsi_id} ({size_gb}GB) ---")
-            attach_cmd = f"qm set {vm_id} --{scsi_id} {proxmox_storage_target}:{size_gb}"
-            execute_ssh_command_streamed(ssh_client, attach_cmd, session_id, log_prefix=f"Create Disk '{scsi_id}'")
+            _update_vm_config(task_proxmox, proxmox_node, vm_id, session_id, **{scsi_id: f"{proxmox_storage_target}:{size_gb}"})
             log_progress(session_id, f"✅ Additional disk on {scsi_id} created successfully.")
         
         log_progress(session_id, "Step F: Setting boot order.")
@@ -355,6 +758,52 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
             log_progress(session_id, f"✅ Boot order set to {boot_disk_scsi_id}.")
         else:
             log_progress(session_id, "⚠️ No boot disk selected, boot order not set.")
+        seed_completed = True
+
+        if replica_nodes:
+            update_node_status(session_id, proxmox_node, state='done')
+            log_progress(session_id, f"Step G: Replicating to {len(replica_nodes)} additional node(s) ({replication_mode}).")
+            replica_reservation, replica_vm_ids = reserve_vm_ids(task_proxmox, count=len(replica_nodes))
+            if len(replica_vm_ids) < len(replica_nodes):
+                raise RuntimeError("Not enough free VM IDs for the replica VMs.")
+            node_ips = get_cluster_node_ips(task_proxmox) if replication_mode == REPLICATION_CLUSTER else {}
+            ssh_node = None
+            seed_ip = None
+            if replication_mode == REPLICATION_CLUSTER and uploaded_disks:
+                # The SSH connection goes to PROXMOX_HOST, which is not necessarily the seed node.
+                ssh_node = get_ssh_host_node(ssh_client, session_id)
+            if replication_mode == REPLICATION_CLUSTER and transport == TRANSPORT_HTTP and uploaded_disks:
+                # The uploaded images are node-local files on the seed; they are copied to the same path on each replica.
+                if ssh_node != proxmox_node:
+                    seed_ip = node_ips.get(proxmox_node)
+                    if not seed_ip:
+                        raise RuntimeError(f"No cluster IP address found for the seed node '{proxmox_node}'.")
+                for disk in uploaded_disks:
+                    disk['source_path'] = get_volume_path(ssh_client, disk['import_volume_id'], session_id, log_prefix="Resolve", node_ip=seed_ip)
+
+            replication_job = {
+                'proxmox_api': task_proxmox, 'ssh_client': ssh_client, 'config': current_config,
+                'transport': transport, 'mode': replication_mode, 'node_ips': node_ips,
+                'ssh_node': ssh_node, 'seed_ip': seed_ip,
+                'vm_config': vm_config, 'storage': proxmox_storage_target, 'remote_temp_dir': PROXMOX_REMOTE_TEMP_DIR,
+                'local_dir': local_unzipped_qcow_dir, 'uploaded_disks': uploaded_disks,
+                'additional_disks': additional_disks, 'boot_disk_scsi_id': boot_disk_scsi_id,
+                'priority': transfer_priority,
+            }
+            replica_threads = [
+                Thread(target=_replicate_to_node, args=(session_id, node, replica_vm_id, replication_job))
+                for node, replica_vm_id in zip(replica_nodes, replica_vm_ids)
+            ]
+            for thread in replica_threads:
+                thread.start()
+            for thread in replica_threads:
+                thread.join()
+
+            node_statuses = get_node_statuses(session_id)
+            failed_nodes = [node for node in replica_nodes if node_statuses.get(node, {}).get('state') != 'done']
+            if failed_nodes:
+                raise RuntimeError(f"The VM was imported on '{proxmox_node}', but replication failed on: {', '.join(failed_nodes)}.")
+            log_progress(session_id, "✅ Replication completed on all nodes.")
 
         log_progress(session_id, "✅ Import completed successfully!")
 
@@ -369,6 +818,8 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
         import traceback
         log_progress(session_id, f"--- Traceback ---\n{traceback.format_exc()}")
     finally:
+        if replica_nodes and not seed_completed:
+            update_node_status(session_id, proxmox_node, state='failed')
         log_progress(session_id, "--- Cleaning up temporary files ---")
         if ssh_client and ssh_client.get_transport() and ssh_client.get_transport().is_active():
             try:
@@ -379,12 +830,19 @@ def _perform_full_vm_import_task(session_id, vm_data, local_zip_file_path):
                 log_progress(session_id, f"⚠️ Error during remote cleanup: {e}.")
             finally:
                 ssh_client.close()
+        for import_volume_id in uploaded_import_volumes:
+            try:
+                task_proxmox.nodes(proxmox_node).storage(proxmox_storage_target).content(quote(import_volume_id, safe='')).delete()
+                log_progress(session_id, f"✅ Removed uploaded image '{import_volume_id}'.")
+            except Exception as e:
+                log_progress(session_id, f"⚠️ Error removing uploaded image '{import_volume_id}': {e}.")
         
-        if local_zip_file_path and os.path.exists(local_zip_file_path):
-            os.remove(local_zip_file_path)
-        if os.path.exists(local_unzipped_qcow_dir):
-            shutil.rmtree(local_unzipped_qcow_dir)
+        # The extracted disks stay in the image library for later imports.
+        release_library_image(image_hash, f"import_{session_id}")
         log_progress(session_id, "✅ Local cleanup completed.")
 
+        release_vm_id_reservation(vm_id_reservation)
+        release_vm_id_reservation(replica_reservation)
+
         if session_id in progress_queues:
             del progress_queues[session_id]
\ No newline at end of file
@@ -0,0 +1,238 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from tools.utils.state_files import file_lock
+
+LIBRARY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'temp_uploads', 'image_library'))
+_METADATA_FILE = "library.json"
+_REFS_DIR = "refs"
+_DEFAULT_MAX_SIZE_GB = 50
+# References older than this belong to abandoned sessions and no longer protect an image from eviction.
+_STALE_REF_SECONDS = 24 * 3600
+
+
+def _library_lock():
+    """Serializes changes to the library across threads and gunicorn workers."""
+    return file_lock(os.path.join(LIBRARY_DIR, ".lock"))
+
+
+def _entry_dir(image_hash):
+    if not image_hash or not all(c in "0123456789abcdef" for c in image_hash):
+        raise ValueError(f"Invalid image hash: {image_hash}")
+    return os.path.join(LIBRARY_DIR, image_hash)
+
+
+def _read_metadata(image_hash):
+    metadata_path = os.path.join(_entry_dir(image_hash), _METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path, "r") as f:
+        return json.load(f)
+
+
+def _write_metadata(image_hash, metadata):
+    metadata_path = os.path.join(_entry_dir(image_hash), _METADATA_FILE)
+    tmp_path = f"{metadata_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f)
+    os.replace(tmp_path, metadata_path)
+
+
+def _active_refs(image_hash):
+    refs_dir = os.path.join(_entry_dir(image_hash), _REFS_DIR)
+    if not os.path.isdir(refs_dir):
+        return []
+    current_time = time.time()
+    refs = []
+    for holder in os.listdir(refs_dir):
+        try:
+            if current_time - os.path.getmtime(os.path.join(refs_dir, holder)) < _STALE_REF_SECONDS:
+                refs.append(holder)
+        except FileNotFoundError:
+            pass
+    return refs
+
+
+def get_library_max_bytes(config):
+    """Reads the library size cap from the IMPORTER section of the configuration."""
+    try:
+        max_size_gb = float(config.get('IMPORTER_LIBRARY_MAX_SIZE_GB') or _DEFAULT_MAX_SIZE_GB)
+    except ValueError:
+        max_size_gb = _DEFAULT_MAX_SIZE_GB
+    return int(max_size_gb * 1024 ** 3)
+
+
+class HashingUploadFile(io.BufferedRandom):
+    """
+    A file that computes the SHA-256 hash of everything written to it. Returned by the stream factory of
+    the form parser, so an upload is hashed while it is spooled to its final path and is written only once.
+    """
+
+    def __init__(self, path):
+        super().__init__(io.FileIO(path, 'w+'))
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return super().write(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def get_library_image(image_hash):
+    """Returns the metadata of a library image, or None if it is not in the library."""
+    try:
+        return _read_metadata(image_hash)
+    except (ValueError, OSError):
+        return None
+
+
+def get_library_image_dir(image_hash):
+    return _entry_dir(image_hash)
+
+
+def list_library_images():
+    """Returns all library images, most recently used first."""
+    if not os.path.isdir(LIBRARY_DIR):
+        return []
+    images = []
+    for image_hash in os.listdir(LIBRARY_DIR):
+        if image_hash.startswith('.'):
+            continue
+        metadata = get_library_image(image_hash)
+        if metadata:
+            metadata['refs'] = len(_active_refs(image_hash))
+            images.append(metadata)
+    return sorted(images, key=lambda m: m['last_used'], reverse=True)
+
+
+def get_library_usage():
+    images = list_library_images()
+    return {
+        'images': len(images),
+        'size_bytes': sum(m['size_bytes'] for m in images),
+    }
+
+
+def add_zip_to_library(zip_path, image_hash, display_name, staging_dir):
+    """
+    Extracts a ZIP archive into the library under its content hash.
+    `staging_dir` is used for the extraction and moved into place once the archive is known to be valid.
+    Returns the library metadata of the image.
+    """
+    existing = get_library_image(image_hash)
+    if existing:
+        return existing
+
+    unzip_executable = shutil.which('unzip')
+    if not unzip_executable:
+        raise RuntimeError("The 'unzip' command was not found on the local server.")
+
+    os.makedirs(staging_dir, exist_ok=True)
+    try:
+        subprocess.run([unzip_executable, "-o", "-qq", zip_path, "-d", staging_dir], check=True, capture_output=True, text=True)
+
+        qcow_files = sorted([f for f in os.listdir(staging_dir) if f.lower().endswith(('.qcow2', '.qcow'))])
+        if not qcow_files:
+            raise ValueError("No .qcow2 or .qcow files found in the ZIP archive.")
+
+        # Only the disk images are kept in the library.
+        for name in os.listdir(staging_dir):
+            path = os.path.join(staging_dir, name)
+            if name not in qcow_files:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+        current_time = time.time()
+        metadata = {
+            'sha256': image_hash,
+            'name': display_name,
+            'qcow_files': qcow_files,
+            'size_bytes': sum(os.path.getsize(os.path.join(staging_dir, f)) for f in qcow_files),
+            'created': current_time,
+            'last_used': current_time,
+        }
+        with open(os.path.join(staging_dir, _METADATA_FILE), "w") as f:
+            json.dump(metadata, f)
+
+        os.makedirs(LIBRARY_DIR, exist_ok=True)
+        if os.stat(staging_dir).st_dev != os.stat(LIBRARY_DIR).st_dev:
+            # The library is on its own volume; copy first so the final rename stays atomic.
+            library_staging_dir = os.path.join(LIBRARY_DIR, f".staging_{image_hash}_{os.getpid()}")
+            shutil.move(staging_dir, library_staging_dir)
+            staging_dir = library_staging_dir
+
+        with _library_lock():
+            entry_dir = _entry_dir(image_hash)
+            if os.path.exists(entry_dir):
+                # Another worker added the same image in the meantime.
+                shutil.rmtree(staging_dir)
+                return _read_metadata(image_hash)
+            os.rename(staging_dir, entry_dir)
+        print(f"[image_library] Added '{display_name}' ({image_hash[:12]}) to the library.")
+        return metadata
+    except Exception:
+        if os.path.exists(staging_dir):
+            shutil.rmtree(staging_dir)
+        raise
+
+
+def acquire_library_image(image_hash, holder):
+    """Marks a library image as in use by `holder` so it is not evicted, and updates its LRU timestamp."""
+    with _library_lock():
+        metadata = _read_metadata(image_hash)
+        if not metadata:
+            raise FileNotFoundError(f"Image {image_hash} is not in the library.")
+        refs_dir = os.path.join(_entry_dir(image_hash), _REFS_DIR)
+        os.makedirs(refs_dir, exist_ok=True)
+        with open(os.path.join(refs_dir, str(holder)), "w"):
+            pass
+        metadata['last_used'] = time.time()
+        _write_metadata(image_hash, metadata)
+        return metadata
+
+
+def release_library_image(image_hash, holder):
+    """Drops the reference of `holder` on a library image."""
+    if not image_hash or not holder:
+        return
+    try:
+        os.remove(os.path.join(_entry_dir(image_hash), _REFS_DIR, str(holder)))
+    except (FileNotFoundError, ValueError):
+        pass
+
+
+def delete_library_image(image_hash):
+    """Removes an image from the library. Images that are in use cannot be removed."""
+    with _library_lock():
+        if not _read_metadata(image_hash):
+            raise FileNotFoundError(f"Image {image_hash} is not in the library.")
+        if _active_refs(image_hash):
+            raise RuntimeError("The image is currently in use and cannot be removed.")
+        shutil.rmtree(_entry_dir(image_hash))
+
+
+def enforce_library_size_limit(max_bytes):
+    """Evicts the least recently used images that are not in use until the library fits within `max_bytes`."""
+    with _library_lock():
+        images = sorted(list_library_images(), key=lambda m: m['last_used'])
+        total_size = sum(m['size_bytes'] for m in images)
+        evicted = []
+        for metadata in images:
+            if total_size <= max_bytes:
+                break
+            if _active_refs(metadata['sha256']):
+                continue
+            shutil.rmtree(_entry_dir(metadata['sha256']), ignore_errors=True)
+            total_size -= metadata['size_bytes']
+            evicted.append(metadata['name'])
+            print(f"[image_library] Evicted '{metadata['name']}' ({metadata['sha256'][:12]}) from the library.")
+        return evicted
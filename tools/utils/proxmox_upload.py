@@ -0,0 +1,236 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config_manager import CONFIG_PATH
+from tools.utils.state_files import locked_json_file, read_json_file
+from tools.utils.ssh_tuning import get_saved_profile
+
+TRANSPORT_SSH = 'ssh'
+TRANSPORT_HTTP = 'http'
+
+# Measured throughput per node/storage and transport, stored next to config.ini.
+STATS_PATH = os.path.join(os.path.dirname(CONFIG_PATH), 'transfer_stats.json')
+# Weight of a new measurement in the moving average.
+_STATS_SMOOTHING = 0.3
+_CHUNK_SIZE = 1024 * 1024
+# A transport that lost the comparison is measured again after this long, in case the link changed.
+_REMEASURE_SECONDS = 7 * 24 * 3600
+# Auto mode avoids a transport this long after it failed, so it cannot lock itself onto a broken one.
+_FAILURE_BACKOFF_SECONDS = 24 * 3600
+# The storage 'import' content type only accepts these disk image formats.
+_HTTP_IMPORT_EXTENSIONS = ('.qcow2', '.raw', '.vmdk')
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_base_url(config):
+    host = config.get('PROXMOX_HOST')
+    if ':' not in host:
+        host = f"{host}:8006"
+    return f"https://{host}/api2/json"
+
+
+def _get_auth_header(config):
+    return f"PVEAPIToken={config.get('PROXMOX_USER')}!{config.get('PROXMOX_TOKEN_NAME')}={config.get('PROXMOX_TOKEN_VALUE')}"
+
+
+def get_http_session(config):
+    """Returns a pooled requests session for the configured Proxmox host."""
+    verify_ssl = config.get('PROXMOX_VERIFY_SSL', 'true').lower() == 'true'
+    key = (_get_base_url(config), verify_ssl, _get_auth_header(config))
+    with _sessions_lock:
+        http_session = _sessions.get(key)
+        if http_session is None:
+            http_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            http_session.mount('https://', adapter)
+            http_session.verify = verify_ssl
+            http_session.headers['Authorization'] = _get_auth_header(config)
+            _sessions[key] = http_session
+        return http_session
+
+
+class MultipartFileStream:
+    """
+    A file-like multipart/form-data body that reads the file lazily,
+    so large images are streamed instead of loaded into memory.
+    """
+
+    def __init__(self, local_path, fields, file_field, filename, callback=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        preamble = "".join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        )
+        preamble += (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        )
+        self._preamble = preamble.encode()
+        self._epilogue = f"\r\n--{boundary}--\r\n".encode()
+        self._file = open(local_path, "rb")
+        self.file_size = os.path.getsize(local_path)
+        self._total = len(self._preamble) + self.file_size + len(self._epilogue)
+        self._position = 0
+        self._callback = callback
+
+    def __len__(self):
+        return self._total
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = _CHUNK_SIZE
+        preamble_length = len(self._preamble)
+        if self._position < preamble_length:
+            data = self._preamble[self._position:self._position + size]
+        elif self._position < preamble_length + self.file_size:
+            data = self._file.read(size)
+            if self._callback:
+                self._callback(self._position - preamble_length + len(data), self.file_size)
+        else:
+            offset = self._position - preamble_length - self.file_size
+            data = self._epilogue[offset:offset + size]
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def upload_image_via_api(config, node, storage, local_path, remote_filename, callback=None):
+    """
+    Streams a disk image to `nodes/{node}/storage/{storage}/upload` with the 'import' content type.
+    `callback(bytes_transferred, total_size)` is called while the file is sent.
+    Returns the UPID of the task that moves the upload into the storage.
+    """
+    url = f"{_get_base_url(config)}/nodes/{node}/storage/{storage}/upload"
+    body = MultipartFileStream(local_path, {'content': 'import'}, 'filename', remote_filename, callback=callback)
+    try:
+        response = get_http_session(config).post(
+            url, data=body, headers={'Content-Type': body.content_type}, timeout=(10, 3600)
+        )
+    finally:
+        body.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"Upload of '{remote_filename}' to '{storage}' failed ({response.status_code}): {response.text.strip()}")
+    return response.json().get('data')
+
+
+def get_import_volume_id(storage, remote_filename):
+    return f"{storage}:import/{remote_filename}"
+
+
+def storage_supports_http_import(proxmox_api, node, storage):
+    """Checks whether a storage on a node accepts uploads with the 'import' content type."""
+    for s in proxmox_api.nodes(node).storage.get():
+        if s['storage'] == storage:
+            return 'import' in s.get('content', '').split(',')
+    return False
+
+
+def _load_stats():
+    return read_json_file(STATS_PATH)
+
+
+def record_transfer_throughput(node, storage, transport, size_bytes, seconds):
+    """Adds a throughput measurement for a transport to the moving average of a node/storage pair."""
+    if seconds <= 0 or size_bytes <= 0:
+        return
+    mb_per_s = size_bytes / (1024 * 1024) / seconds
+    with locked_json_file(STATS_PATH, indent=2) as stats:
+        entry = stats.setdefault(f"{node}/{storage}", {}).setdefault(transport, {})
+        if entry.get('samples'):
+            mb_per_s = (1 - _STATS_SMOOTHING) * entry['mb_per_s'] + _STATS_SMOOTHING * mb_per_s
+        entry['mb_per_s'] = round(mb_per_s, 2)
+        entry['samples'] = entry.get('samples', 0) + 1
+        entry['updated'] = time.time()
+        entry.pop('failed_at', None)
+        entry.pop('error', None)
+
+
+def record_transport_failure(node, storage, transport, error):
+    """Marks a transport as failed for a node/storage pair, so auto mode does not pick it again for a while."""
+    with locked_json_file(STATS_PATH, indent=2) as stats:
+        entry = stats.setdefault(f"{node}/{storage}", {}).setdefault(transport, {})
+        entry['failed_at'] = time.time()
+        entry['error'] = str(error)
+
+
+@contextmanager
+def transport_attempt(node, storage, transport):
+    """Records a failure of `transport` to a node/storage pair when the block raises, and re-raises it."""
+    try:
+        yield
+    except Exception as e:
+        record_transport_failure(node, storage, transport, e)
+        raise
+
+
+def _failed_recently(entry):
+    return time.time() - entry.get('failed_at', 0) < _FAILURE_BACKOFF_SECONDS
+
+
+def get_transfer_stats():
+    return _load_stats()
+
+
+def select_transport(config, proxmox_api, node, storage, filenames):
+    """
+    Chooses how disk images reach a node/storage pair. Returns a (transport, reason) tuple.
+    IMPORTER.transport can force 'ssh' or 'http'; with 'auto' the HTTP upload is used when the
+    storage supports it, unless measurements show that SSH is faster for this storage.
+    Without SSH measurements for the storage, the SSH tuning result is used as an estimate, or
+    the next import probes SSH once. The slower transport is re-measured every week.
+    A transport that failed for the storage is avoided for a day.
+    """
+    mode = (config.get('IMPORTER_TRANSPORT') or 'auto').lower()
+    if mode == TRANSPORT_SSH:
+        return TRANSPORT_SSH, "forced by configuration"
+
+    http_supported = all(f.lower().endswith(_HTTP_IMPORT_EXTENSIONS) for f in filenames)
+    http_supported = http_supported and storage_supports_http_import(proxmox_api, node, storage)
+    if mode == TRANSPORT_HTTP:
+        if not http_supported:
+            raise RuntimeError(f"Storage '{storage}' on '{node}' does not accept 'import' content, or the disk format is not supported by the upload API.")
+        return TRANSPORT_HTTP, "forced by configuration"
+    if not http_supported:
+        return TRANSPORT_SSH, f"storage '{storage}' does not accept 'import' uploads"
+    if not config.get('SSH_USERNAME') or not config.get('SSH_AUTH_METHOD'):
+        return TRANSPORT_HTTP, "SSH is not configured"
+
+    measured = _load_stats().get(f"{node}/{storage}", {})
+    http_stats = measured.get(TRANSPORT_HTTP, {})
+    ssh_stats = measured.get(TRANSPORT_SSH, {})
+    if _failed_recently(ssh_stats):
+        return TRANSPORT_HTTP, f"SSH failed recently for this storage: {ssh_stats['error']}"
+    if _failed_recently(http_stats):
+        return TRANSPORT_SSH, f"HTTP upload failed recently for this storage: {http_stats['error']}"
+    if 'mb_per_s' not in http_stats:
+        return TRANSPORT_HTTP, f"storage '{storage}' accepts 'import' uploads"
+    http_rate = http_stats['mb_per_s']
+
+    if 'mb_per_s' in ssh_stats:
+        ssh_rate = ssh_stats['mb_per_s']
+        ssh_source = "over SSH"
+    else:
+        tuned_rate = (get_saved_profile(config) or {}).get('throughput_mb_per_s')
+        if not tuned_rate:
+            return TRANSPORT_SSH, f"probing SSH throughput ({http_rate} MB/s measured over HTTP)"
+        ssh_rate = tuned_rate
+        ssh_source = "over SSH (tuning estimate)"
+
+    if ssh_rate > http_rate:
+        if time.time() - http_stats['updated'] > _REMEASURE_SECONDS:
+            return TRANSPORT_HTTP, "re-measuring HTTP throughput"
+        return TRANSPORT_SSH, f"measured {ssh_rate} MB/s {ssh_source} vs {http_rate} MB/s over HTTP"
+    if 'mb_per_s' in ssh_stats and time.time() - ssh_stats['updated'] > _REMEASURE_SECONDS:
+        return TRANSPORT_SSH, "re-measuring SSH throughput"
+    return TRANSPORT_HTTP, f"measured {http_rate} MB/s over HTTP vs {ssh_rate} MB/s {ssh_source}"
@@ -0,0 +1,86 @@
+import shlex
+import time
+
+from tools.utils.shared_utils import execute_ssh_command_streamed
+from tools.utils.state_files import locked_json_file, read_json_file
+
+# Options for SSH between cluster nodes. Proxmox cluster nodes trust each other's root key.
+_NODE_SSH_OPTIONS = "-o BatchMode=yes -o StrictHostKeyChecking=accept-new"
+
+
+def get_cluster_node_ips(proxmox_api):
+    """Returns a {node_name: ip} mapping of the cluster nodes, as seen on the cluster network."""
+    return {
+        entry['name']: entry['ip']
+        for entry in proxmox_api.cluster.status.get()
+        if entry.get('type') == 'node' and entry.get('ip')
+    }
+
+
+def is_shared_storage(proxmox_api, node, storage):
+    """Checks whether a storage is shared, i.e. every node sees the same volumes."""
+    for s in proxmox_api.nodes(node).storage.get():
+        if s['storage'] == storage:
+            return bool(int(s.get('shared', 0)))
+    return False
+
+
+def run_on_node(ssh_client, node_ip, command, session_id, log_prefix="", allow_failure=False):
+    """Runs a command on another cluster node by hopping through the seed node's SSH connection."""
+    remote_command = f"ssh {_NODE_SSH_OPTIONS} root@{node_ip} {shlex.quote(command)}"
+    return execute_ssh_command_streamed(ssh_client, remote_command, session_id, log_prefix=log_prefix, allow_failure=allow_failure)
+
+
+def get_ssh_host_node(ssh_client, session_id):
+    """Returns the name of the cluster node that the SSH connection is on. Proxmox node names are host names."""
+    return execute_ssh_command_streamed(ssh_client, "hostname", session_id, log_prefix="Node").strip().splitlines()[-1]
+
+
+def copy_to_node(ssh_client, source_path, node_ip, target_dir, session_id, log_prefix="", bwlimit=None, source_node_ip=None):
+    """
+    Copies a file or directory to another node over the cluster network with rsync.
+    The source is on the SSH host, or on `source_node_ip` when the files live on another node.
+    `bwlimit` limits the copy to that many bytes/s.
+    """
+    run_on_node(ssh_client, node_ip, f"mkdir -p {shlex.quote(target_dir)}", session_id, log_prefix=log_prefix)
+    # rsync takes the limit in KiB/s.
+    bwlimit_option = f"--bwlimit={max(int(bwlimit / 1024), 1)} " if bwlimit else ""
+    rsync_cmd = (
+        f"rsync -a {bwlimit_option}-e {shlex.quote(f'ssh {_NODE_SSH_OPTIONS}')} "
+        f"{shlex.quote(source_path)} root@{node_ip}:{shlex.quote(target_dir.rstrip('/') + '/')}"
+    )
+    if source_node_ip:
+        run_on_node(ssh_client, source_node_ip, rsync_cmd, session_id, log_prefix=log_prefix)
+    else:
+        execute_ssh_command_streamed(ssh_client, rsync_cmd, session_id, log_prefix=log_prefix)
+
+
+def get_volume_path(ssh_client, volume_id, session_id, log_prefix="", node_ip=None):
+    """Resolves a storage volume ID to its file system path, on the SSH host or on `node_ip`."""
+    command = f"pvesm path {shlex.quote(volume_id)}"
+    if node_ip:
+        output = run_on_node(ssh_client, node_ip, command, session_id, log_prefix=log_prefix)
+    else:
+        output = execute_ssh_command_streamed(ssh_client, command, session_id, log_prefix=log_prefix)
+    return output.strip().splitlines()[-1]
+
+
+def _status_file(session_id):
+    return f"/tmp/progress_{session_id}_nodes.json"
+
+
+def update_node_status(session_id, node, **fields):
+    """Updates the replication status of one node. Stored in a file so every worker can report it."""
+    with locked_json_file(_status_file(session_id)) as statuses:
+        status = statuses.setdefault(node, {})
+        status.update(fields)
+        status['updated'] = time.time()
+
+
+def reset_node_statuses(session_id):
+    with locked_json_file(_status_file(session_id)) as statuses:
+        statuses.clear()
+
+
+def get_node_statuses(session_id):
+    return read_json_file(_status_file(session_id))
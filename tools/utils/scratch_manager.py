@@ -0,0 +1,211 @@
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+
+from tools.utils.state_files import locked_json_file
+
+# Uploaded ZIP files and extraction directories live here. The image library has its own size limit.
+SCRATCH_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'temp_uploads'))
+_LEDGER_FILE = ".scratch_ledger.json"
+_EXCLUDED_ENTRIES = ('image_library',)
+# Scratch entries created by the importer: '<session>_<name>.zip' and '_tmp_proxmox_importer_<session>'.
+_SCRATCH_ENTRY_PATTERN = re.compile(r'^(\d+_.+|_tmp_proxmox_importer_\d+)$')
+# The replication status pattern includes the '.lock' and '.tmp' sidecars of locked_json_file.
+_PROGRESS_FILE_PATTERNS = ('/tmp/progress_*.log', '/tmp/progress_*_nodes.json*')
+_DEFAULT_QUOTA_GB = 20
+_DEFAULT_TTL_HOURS = 24
+_DEFAULT_QUEUE_TIMEOUT = 30
+# Free space that admission control always leaves on the disk.
+_DISK_RESERVE_BYTES = 512 * 1024 * 1024
+_QUEUE_POLL_INTERVAL = 1
+_SWEEP_INTERVAL = 600
+
+_sweeper_started = False
+_sweeper_lock = threading.Lock()
+
+
+class ScratchQuotaExceeded(RuntimeError):
+    """Raised when a reservation does not fit within the scratch quota or the free disk space."""
+
+
+def _ledger():
+    """Yields the reservation ledger under an exclusive lock and writes it back afterwards."""
+    return locked_json_file(os.path.join(SCRATCH_DIR, _LEDGER_FILE))
+
+
+def _format_size(size_bytes):
+    if abs(size_bytes) >= 1024 ** 3:
+        return f"{size_bytes / 1024 ** 3:.2f} GB"
+    return f"{size_bytes / 1024 ** 2:.1f} MB"
+
+
+def _read_setting(config, key, default):
+    try:
+        return float(config.get(key) or default)
+    except ValueError:
+        return default
+
+
+def get_scratch_quota_bytes(config):
+    return int(_read_setting(config, 'IMPORTER_SCRATCH_QUOTA_GB', _DEFAULT_QUOTA_GB) * 1024 ** 3)
+
+
+def get_scratch_ttl_seconds(config):
+    return int(_read_setting(config, 'IMPORTER_SCRATCH_TTL_HOURS', _DEFAULT_TTL_HOURS) * 3600)
+
+
+def get_scratch_queue_timeout(config):
+    return _read_setting(config, 'IMPORTER_SCRATCH_QUEUE_TIMEOUT', _DEFAULT_QUEUE_TIMEOUT)
+
+
+def _drop_expired(reservations, ttl_seconds):
+    current_time = time.time()
+    for token in [t for t, r in reservations.items() if current_time - r['updated'] > ttl_seconds]:
+        print(f"[scratch_manager] Dropping expired reservation '{reservations[token]['label']}'.")
+        del reservations[token]
+
+
+def _try_reserve(reservations, token, size_bytes, label, quota_bytes):
+    """Adds or resizes a reservation if it fits. Returns an error message if it does not."""
+    reserved_by_others = sum(r['bytes'] for t, r in reservations.items() if t != token)
+    if reserved_by_others + size_bytes > quota_bytes:
+        return (f"Not enough scratch space: {_format_size(size_bytes)} needed, "
+                f"{_format_size(max(quota_bytes - reserved_by_others, 0))} of the {_format_size(quota_bytes)} quota available.")
+    already_reserved = reservations.get(token, {}).get('bytes', 0)
+    # Reserved space that is not on disk yet will still be written by the running uploads.
+    unwritten_bytes = max(reserved_by_others + already_reserved - _scratch_used_bytes(), 0)
+    free_bytes = shutil.disk_usage(SCRATCH_DIR).free - _DISK_RESERVE_BYTES - unwritten_bytes
+    if size_bytes - already_reserved > free_bytes:
+        return f"Not enough free disk space: {_format_size(size_bytes)} needed, {_format_size(max(free_bytes, 0))} free."
+    reservations[token] = {
+        'bytes': size_bytes,
+        'label': label,
+        'created': reservations.get(token, {}).get('created', time.time()),
+        'updated': time.time(),
+    }
+    return None
+
+
+def reserve_scratch_space(config, size_bytes, label, token=None):
+    """
+    Reserves `size_bytes` of scratch space and returns the reservation token.
+    Passing an existing `token` resizes that reservation. When the space is not available, the request
+    waits in line for up to IMPORTER.scratch_queue_timeout seconds before ScratchQuotaExceeded is raised.
+    """
+    quota_bytes = get_scratch_quota_bytes(config)
+    ttl_seconds = get_scratch_ttl_seconds(config)
+    if size_bytes > quota_bytes:
+        raise ScratchQuotaExceeded(f"The upload needs {_format_size(size_bytes)}, more than the scratch quota of {_format_size(quota_bytes)}.")
+    token = token or uuid.uuid4().hex
+    deadline = time.monotonic() + get_scratch_queue_timeout(config)
+    while True:
+        with _ledger() as reservations:
+            _drop_expired(reservations, ttl_seconds)
+            error = _try_reserve(reservations, token, size_bytes, label, quota_bytes)
+        if not error:
+            return token
+        if time.monotonic() >= deadline:
+            raise ScratchQuotaExceeded(f"{error} Please try again when other imports have finished.")
+        time.sleep(_QUEUE_POLL_INTERVAL)
+
+
+def release_scratch_space(token):
+    if not token:
+        return
+    with _ledger() as reservations:
+        reservations.pop(token, None)
+
+
+def get_zip_extracted_size(zip_path):
+    """Returns the total uncompressed size of a ZIP archive, read from its central directory."""
+    with zipfile.ZipFile(zip_path) as archive:
+        return sum(info.file_size for info in archive.infolist())
+
+
+def _entry_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total_size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total_size += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total_size
+
+
+def _scratch_used_bytes():
+    return sum(
+        _entry_size(os.path.join(SCRATCH_DIR, name))
+        for name in os.listdir(SCRATCH_DIR)
+        if not name.startswith('.') and name not in _EXCLUDED_ENTRIES
+    )
+
+
+def get_scratch_usage(config):
+    """Returns the quota, the reserved space and the space actually used on disk by scratch files."""
+    with _ledger() as reservations:
+        _drop_expired(reservations, get_scratch_ttl_seconds(config))
+        active = [dict(r) for r in reservations.values()]
+    return {
+        'quota_bytes': get_scratch_quota_bytes(config),
+        'reserved_bytes': sum(r['bytes'] for r in active),
+        'used_bytes': _scratch_used_bytes(),
+        'disk_free_bytes': shutil.disk_usage(SCRATCH_DIR).free,
+        'reservations': sorted(active, key=lambda r: r['created']),
+    }
+
+
+def sweep_scratch_space(config):
+    """
+    Removes scratch files and progress logs older than the TTL, which are left behind by
+    abandoned sessions or crashed workers. Returns the names of the removed entries.
+    """
+    ttl_seconds = get_scratch_ttl_seconds(config)
+    cutoff = time.time() - ttl_seconds
+    removed = []
+    with _ledger() as reservations:
+        _drop_expired(reservations, ttl_seconds)
+
+    candidates = [os.path.join(SCRATCH_DIR, name) for name in os.listdir(SCRATCH_DIR) if _SCRATCH_ENTRY_PATTERN.match(name)]
+    for pattern in _PROGRESS_FILE_PATTERNS:
+        candidates.extend(glob.glob(pattern))
+    for path in candidates:
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed.append(os.path.basename(path))
+        except FileNotFoundError:
+            pass
+    if removed:
+        print(f"[scratch_manager] Removed {len(removed)} orphaned scratch entries: {', '.join(removed)}")
+    return removed
+
+
+def start_scratch_sweeper(load_config, interval=_SWEEP_INTERVAL):
+    """Starts the background sweeper once per process. `load_config` is called on every run."""
+    global _sweeper_started
+    with _sweeper_lock:
+        if _sweeper_started:
+            return
+        _sweeper_started = True
+
+    def sweep_forever():
+        while True:
+            try:
+                sweep_scratch_space(load_config())
+            except Exception as e:
+                print(f"[scratch_manager] Sweep failed: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=sweep_forever, daemon=True).start()
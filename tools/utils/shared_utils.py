@@ -11,6 +11,7 @@ import json
 import threading
 
 from config_manager import load_config
+from tools.utils.ssh_tuning import ensure_tuned, get_transfer_profile, get_cipher_connect_kwargs
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -49,6 +50,13 @@ def get_progress_messages(session_id, last_position=0):
     except:
         return [], 0
 
+def clear_progress_messages(session_id):
+    """Removes the progress log of a session, so a retried import does not replay the previous run."""
+    try:
+        os.remove(f"/tmp/progress_{session_id}.log")
+    except FileNotFoundError:
+        pass
+
 
 _cache = {}
 _CACHE_EXPIRATION_SECONDS = 300
@@ -79,9 +87,21 @@ def test_api_connection(config):
         print(f"❌ {error_message}")
         return (False, error_message)
 
-def get_ssh_client(config):
+def get_ssh_client(config, tune=False, session_id=None):
     """
     Creates and configures a Paramiko SSH client based on the given configuration.
+    Uses the host's transfer profile (tuned or overridden) for cipher selection.
+    With `tune` set, the host is tuned first if SSH tuning is enabled and it has no profile yet.
+    Returns a connected client object.
+    """
+    if tune:
+        log = (lambda message: log_progress(session_id, message)) if session_id else print
+        ensure_tuned(config, connect_ssh_client, log=log)
+    return connect_ssh_client(config, cipher=get_transfer_profile(config)['cipher'])
+
+def connect_ssh_client(config, cipher=None):
+    """
+    Connects a Paramiko SSH client, optionally restricted to a single cipher.
     Returns a connected client object.
     """
     ssh_host = config.get('PROXMOX_HOST')
@@ -103,7 +123,8 @@ def get_ssh_client(config):
             raise ValueError("SSH password is required for password authentication.")
         ssh_client.connect(
             hostname=ssh_host, port=ssh_port,
-            username=ssh_username, password=ssh_password, timeout=10
+            username=ssh_username, password=ssh_password, timeout=10,
+            **get_cipher_connect_kwargs(cipher)
         )
     elif auth_method == 'key':
         key_path = config.get('SSH_PRIVATE_KEY_PATH')
@@ -126,7 +147,8 @@ def get_ssh_client(config):
 
         ssh_client.connect(
             hostname=ssh_host, port=ssh_port,
-            username=ssh_username, pkey=key, timeout=10
+            username=ssh_username, pkey=key, timeout=10,
+            **get_cipher_connect_kwargs(cipher)
         )
     else:
         raise ValueError(f"Invalid SSH auth_method: {auth_method}")
@@ -238,4 +260,36 @@ def execute_ssh_command_streamed(ssh_client, command, session_id, log_prefix="",
     if exit_status != 0 and not allow_failure:
         raise RuntimeError(f"Command '{command}' failed with exit code {exit_status}. Full output:\n{output_str}")
         
-    return output_str
\ No newline at end of file
+    return output_str
+
+def _log_task_warnings(proxmox_api, node, upid, exit_status, session_id):
+    messages = [f"⚠️ Proxmox task {upid} finished with {exit_status}."]
+    try:
+        messages += [f"⚠️ > {line['t']}" for line in proxmox_api.nodes(node).tasks(upid).log.get() if line.get('t', '').startswith('WARN')]
+    except Exception as e:
+        print(f"Could not read the log of Proxmox task {upid}: {e}")
+    for message in messages:
+        if session_id:
+            log_progress(session_id, message)
+        else:
+            print(message)
+
+def wait_for_proxmox_task(proxmox_api, node, upid, timeout=3600, poll_interval=2, session_id=None):
+    """
+    Waits until a Proxmox task has finished.
+    A task that finished with warnings ('WARNINGS: n') succeeded; its warnings are logged.
+    Raises a RuntimeError if the task fails or does not finish in time.
+    """
+    start_time = time.time()
+    while True:
+        status = proxmox_api.nodes(node).tasks(upid).status.get()
+        if status.get('status') == 'stopped':
+            exit_status = status.get('exitstatus') or ''
+            if exit_status.startswith('WARNINGS'):
+                _log_task_warnings(proxmox_api, node, upid, exit_status, session_id)
+            elif exit_status != 'OK':
+                raise RuntimeError(f"Proxmox task {upid} failed: {exit_status}")
+            return status
+        if time.time() - start_time > timeout:
+            raise RuntimeError(f"Timed out waiting for Proxmox task {upid}.")
+        time.sleep(poll_interval)
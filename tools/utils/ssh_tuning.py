@@ -0,0 +1,193 @@
+import io
+import os
+import threading
+import time
+import uuid
+
+import paramiko
+
+from config_manager import CONFIG_PATH
+from tools.utils.state_files import locked_json_file, read_json_file
+
+# Tuning profiles are stored next to config.ini so they survive container restarts.
+PROFILES_PATH = os.path.join(os.path.dirname(CONFIG_PATH), 'ssh_tuning.json')
+
+# Ciphers in order of preference. Ciphers the installed paramiko does not support are skipped.
+CANDIDATE_CIPHERS = [
+    'aes128-gcm@openssh.com',
+    'aes256-gcm@openssh.com',
+    'chacha20-poly1305@openssh.com',
+    'aes128-ctr',
+    'aes256-ctr',
+]
+_DEFAULT_TEST_SIZE_MB = 16
+# The test payload is held in memory by the import worker.
+_MAX_TEST_SIZE_MB = 256
+# After a failed tuning run, imports skip tuning for this long instead of repeating the benchmark.
+_TUNING_RETRY_SECONDS = 3600
+
+_tuning_locks = {}
+_tuning_locks_lock = threading.Lock()
+
+
+def _profile_key(config):
+    return f"{config.get('PROXMOX_HOST')}:{int(config.get('SSH_PORT') or 22)}"
+
+
+def _load_profiles():
+    return read_json_file(PROFILES_PATH)
+
+
+def _save_profile(key, profile):
+    with locked_json_file(PROFILES_PATH, indent=2) as profiles:
+        if profile is None:
+            profiles.pop(key, None)
+        else:
+            profiles[key] = profile
+
+
+def supported_ciphers():
+    """Returns the candidate ciphers that the installed paramiko version can negotiate."""
+    return [c for c in CANDIDATE_CIPHERS if c in paramiko.Transport._preferred_ciphers]
+
+
+def is_tuning_enabled(config):
+    return (config.get('SSH_TUNING_MODE') or 'off').lower() == 'auto'
+
+
+def get_saved_profile(config):
+    """Returns the tuned profile of the configured host, or None. Failed tuning attempts are not profiles."""
+    profile = _load_profiles().get(_profile_key(config))
+    return profile if profile and profile.get('cipher') else None
+
+
+def get_tuning_report():
+    """
+    Returns all saved tuning profiles, including the measurements they are based on.
+    Hosts where automatic tuning failed have an entry with 'failed_at' and 'error' instead.
+    """
+    return _load_profiles()
+
+
+def reset_tuning_profile(config):
+    _save_profile(_profile_key(config), None)
+
+
+def get_transfer_profile(config):
+    """
+    Returns the transfer settings for the configured host as a dictionary with 'cipher' and 'source'.
+    The cipher is None where paramiko's default applies. A cipher override in the configuration
+    takes precedence over the tuned profile.
+    """
+    profile = {'cipher': None, 'source': 'default'}
+    saved = get_saved_profile(config)
+    if saved:
+        profile['cipher'] = saved.get('cipher')
+        profile['source'] = 'tuned'
+
+    override_cipher = config.get('SSH_CIPHER')
+    if override_cipher:
+        if override_cipher not in paramiko.Transport._preferred_ciphers:
+            raise ValueError(f"SSH cipher '{override_cipher}' is not supported. Supported: {', '.join(paramiko.Transport._preferred_ciphers)}")
+        profile['cipher'] = override_cipher
+        profile['source'] = 'override'
+
+    if profile['cipher'] and profile['cipher'] not in paramiko.Transport._preferred_ciphers:
+        # A profile tuned with a different paramiko version; fall back to the defaults.
+        profile['cipher'] = None
+    return profile
+
+
+def get_cipher_connect_kwargs(cipher):
+    """Returns the extra SSHClient.connect() arguments that restrict negotiation to a single cipher."""
+    if not cipher:
+        return {}
+    return {'disabled_algorithms': {'ciphers': [c for c in paramiko.Transport._preferred_ciphers if c != cipher]}}
+
+
+def _measure_upload(config, connect, cipher, payload):
+    """Uploads `payload` once with the given cipher and returns the throughput in MB/s."""
+    ssh_client = connect(config, cipher=cipher)
+    try:
+        remote_path = f"/tmp/fortitoolbox_tuning_{uuid.uuid4().hex}"
+        sftp_client = ssh_client.open_sftp()
+        try:
+            start_time = time.monotonic()
+            sftp_client.putfo(io.BytesIO(payload), remote_path, file_size=len(payload), confirm=True)
+            elapsed = time.monotonic() - start_time
+            sftp_client.remove(remote_path)
+        finally:
+            sftp_client.close()
+        return len(payload) / (1024 * 1024) / max(elapsed, 1e-6)
+    finally:
+        ssh_client.close()
+
+
+def run_ssh_tuning(config, connect, log=print):
+    """
+    Measures upload throughput to the configured host for the candidate ciphers,
+    and saves the fastest one as the host's transfer profile.
+    `connect(config, cipher=...)` returns an SSH client that only negotiates the given cipher.
+    """
+    key = _profile_key(config)
+    try:
+        test_size_mb = int(config.get('SSH_TUNING_TEST_SIZE_MB') or _DEFAULT_TEST_SIZE_MB)
+    except ValueError:
+        test_size_mb = _DEFAULT_TEST_SIZE_MB
+    test_size_mb = min(max(test_size_mb, 1), _MAX_TEST_SIZE_MB)
+    payload = os.urandom(test_size_mb * 1024 * 1024)
+    results = []
+
+    log(f"SSH tuning for {key}: testing with {test_size_mb} MB per run.")
+    for cipher in supported_ciphers():
+        result = {'cipher': cipher}
+        try:
+            result['throughput_mb_per_s'] = round(_measure_upload(config, connect, cipher, payload), 2)
+            log(f"SSH tuning for {key}: {cipher}: {result['throughput_mb_per_s']} MB/s")
+        except Exception as e:
+            result['error'] = str(e)
+            log(f"SSH tuning for {key}: {cipher} failed: {e}")
+        results.append(result)
+
+    cipher_results = [r for r in results if 'throughput_mb_per_s' in r]
+    if not cipher_results:
+        raise RuntimeError(f"SSH tuning for {key} failed: none of the candidate ciphers could be used.")
+    best = max(cipher_results, key=lambda r: r['throughput_mb_per_s'])
+
+    profile = {
+        'cipher': best['cipher'],
+        'throughput_mb_per_s': best['throughput_mb_per_s'],
+        # Throughput with paramiko's default cipher, for comparison in the report.
+        'baseline_mb_per_s': next((r['throughput_mb_per_s'] for r in cipher_results if r['cipher'] == paramiko.Transport._preferred_ciphers[0]), None),
+        'test_size_mb': test_size_mb,
+        'tuned_at': time.time(),
+        'results': results,
+    }
+    _save_profile(key, profile)
+    log(f"SSH tuning for {key}: selected {best['cipher']} ({best['throughput_mb_per_s']} MB/s).")
+    return profile
+
+
+def ensure_tuned(config, connect, log=print):
+    """
+    Runs tuning once per host when tuning is enabled and no profile or override exists yet.
+    A failed run is recorded and only retried after _TUNING_RETRY_SECONDS, or once the profile is reset.
+    """
+    if not is_tuning_enabled(config) or config.get('SSH_CIPHER'):
+        return
+    key = _profile_key(config)
+    with _tuning_locks_lock:
+        lock = _tuning_locks.setdefault(key, threading.Lock())
+    with lock:
+        saved = _load_profiles().get(key)
+        if saved and saved.get('cipher'):
+            return
+        if saved and time.time() - saved.get('failed_at', 0) < _TUNING_RETRY_SECONDS:
+            log(f"SSH tuning for {key} failed recently, using default settings until it is retried.")
+            return
+        try:
+            run_ssh_tuning(config, connect, log=log)
+        except Exception as e:
+            # Tuning is an optimization; transfers continue with paramiko's defaults.
+            log(f"⚠️ SSH tuning for {key} failed, using default settings: {e}")
+            _save_profile(key, {'failed_at': time.time(), 'error': str(e)})
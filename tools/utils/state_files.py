@@ -0,0 +1,53 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+_FILE_LOCK_POLL_INTERVAL = 0.05
+
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    Holds an exclusive flock on `lock_path`, shared by threads and gunicorn workers.
+    The lock is polled instead of blocking, so waiting never stalls the other greenlets of a gevent worker.
+    """
+    lock_dir = os.path.dirname(lock_path)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(_FILE_LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_json_file(path, default=dict):
+    """Reads a JSON state file. Missing or unreadable files return `default()`."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default()
+
+
+@contextmanager
+def locked_json_file(path, default=dict, indent=None):
+    """
+    Yields the content of a JSON state file under an exclusive lock and atomically writes it back
+    afterwards, unless the block raised. Keep the block short and free of network calls.
+    """
+    with file_lock(f"{path}.lock"):
+        data = read_json_file(path, default)
+        yield data
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp_path, path)
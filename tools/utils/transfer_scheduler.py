@@ -0,0 +1,186 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from tools.utils.state_files import locked_json_file
+
+# Active transfers of all gunicorn workers, so bandwidth is shared across processes.
+REGISTRY_PATH = "/tmp/fortitoolbox_transfers.json"
+# Relative weight of a job when the bandwidth to a host is divided.
+PRIORITIES = {'low': 1, 'normal': 2, 'high': 4}
+DEFAULT_PRIORITY = 'normal'
+# How often a job re-reads its share and publishes its progress.
+_SHARE_REFRESH_INTERVAL = 1.0
+# Jobs that have not published progress for this long belong to a crashed worker.
+_STALE_JOB_SECONDS = 30
+# A fixed-rate job cannot give bandwidth back later, so it never takes more than this part of the limit.
+_FIXED_SHARE_MAX_FRACTION = 0.5
+# Every job keeps at least this part of the limit, so a host taken by fixed-rate jobs does not stall new ones.
+_MIN_SHARE_FRACTION = 0.05
+
+
+@contextmanager
+def _registry():
+    """Yields the registry of active transfers under an exclusive lock and writes it back afterwards."""
+    with locked_json_file(REGISTRY_PATH) as jobs:
+        current_time = time.time()
+        for job_id in [j for j, job in jobs.items() if current_time - job['updated'] > _STALE_JOB_SECONDS]:
+            del jobs[job_id]
+        yield jobs
+
+
+def get_destination_host(config):
+    """Returns the host name that uploads to the configured Proxmox host go to, without a port."""
+    return (config.get('PROXMOX_HOST') or '').split(':')[0]
+
+
+def get_host_limit_bytes(config, host):
+    """
+    Returns the bandwidth limit for a destination host in bytes/s, or None when it is unlimited.
+    IMPORTER.bandwidth_host_limits ('host=MB/s, ...') overrides IMPORTER.bandwidth_limit for single hosts.
+    """
+    limit = config.get('IMPORTER_BANDWIDTH_LIMIT')
+    for entry in (config.get('IMPORTER_BANDWIDTH_HOST_LIMITS') or '').split(','):
+        name, _, value = entry.partition('=')
+        if name.strip() == host and value.strip():
+            limit = value.strip()
+            break
+    try:
+        limit_mb_per_s = float(limit or 0)
+    except ValueError:
+        print(f"[transfer_scheduler] Ignoring invalid bandwidth limit '{limit}' for {host}.")
+        return None
+    return int(limit_mb_per_s * 1024 * 1024) if limit_mb_per_s > 0 else None
+
+
+def get_active_transfers():
+    """Returns all active transfers with their share and achieved rate, grouped by destination host."""
+    with _registry() as jobs:
+        transfers = {}
+        for job_id, job in sorted(jobs.items(), key=lambda item: item[1]['started']):
+            transfers.setdefault(job['host'], []).append(dict(job, job_id=job_id))
+        return transfers
+
+
+def _format_rate(bytes_per_second):
+    return f"{bytes_per_second / (1024 * 1024):.1f} MB/s"
+
+
+class TransferJob:
+    """
+    A single upload to a destination host. While jobs to the same host run, the host's bandwidth
+    limit is divided between them in proportion to their priority. Use as a context manager and
+    report transferred bytes with consume(), or pass wrap_callback() as a progress callback.
+
+    A `fixed_rate` job, such as an rsync with --bwlimit, gets its share once when it starts and keeps
+    it for its whole run. A heartbeat keeps it registered, and the other jobs to the same host divide
+    what is left of the limit.
+    """
+
+    def __init__(self, config, host, label, priority=DEFAULT_PRIORITY, fixed_rate=False):
+        self.job_id = uuid.uuid4().hex
+        self.host = host
+        self.label = label
+        self.priority = priority if priority in PRIORITIES else DEFAULT_PRIORITY
+        self.fixed_rate = fixed_rate
+        self.limit = get_host_limit_bytes(config, host)
+        self.share = None
+        self.bytes_transferred = 0
+        # Time spent sleeping to stay within the share, so the unthrottled rate can be estimated.
+        self.throttled_seconds = 0
+        self._started = None
+        self._finished = None
+        self._window_start = None
+        self._window_bytes = 0
+        self._heartbeat_stop = None
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        self._refresh()
+        if self.fixed_rate:
+            self._heartbeat_stop = threading.Event()
+            threading.Thread(target=self._heartbeat, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._finished = time.monotonic()
+        if self._heartbeat_stop:
+            self._heartbeat_stop.set()
+        with _registry() as jobs:
+            jobs.pop(self.job_id, None)
+        return False
+
+    def _heartbeat(self):
+        while not self._heartbeat_stop.wait(_SHARE_REFRESH_INTERVAL):
+            self._refresh()
+
+    @property
+    def achieved_rate(self):
+        """The average rate of this job so far, in bytes/s."""
+        elapsed = (self._finished or time.monotonic()) - self._started
+        return self.bytes_transferred / elapsed if elapsed > 0 else 0
+
+    def _refresh(self):
+        """Publishes this job's progress and recalculates its share of the host's bandwidth."""
+        with _registry() as jobs:
+            if self._heartbeat_stop and self._heartbeat_stop.is_set():
+                return
+            job = jobs.setdefault(self.job_id, {
+                'host': self.host,
+                'label': self.label,
+                'priority': self.priority,
+                'fixed': self.fixed_rate,
+                'started': time.time(),
+            })
+            job.update(bytes=self.bytes_transferred, rate=round(self.achieved_rate), updated=time.time())
+            if self.limit and not (self.fixed_rate and self.share):
+                self.share = self._calculate_share(jobs)
+            job['share'] = round(self.share) if self.share else None
+        # The rate is enforced per refresh window, so a job that fell behind cannot burst above its share.
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+
+    def _calculate_share(self, jobs):
+        others = [j for job_id, j in jobs.items() if j['host'] == self.host and job_id != self.job_id]
+        weight = PRIORITIES[self.priority]
+        available = self.limit - sum(j['share'] or 0 for j in others if j.get('fixed'))
+        if self.fixed_rate:
+            total_weight = weight + sum(PRIORITIES[j['priority']] for j in others)
+            share = min(self.limit * weight / total_weight, self.limit * _FIXED_SHARE_MAX_FRACTION, available)
+        else:
+            dynamic_weight = weight + sum(PRIORITIES[j['priority']] for j in others if not j.get('fixed'))
+            share = available * weight / dynamic_weight
+        return max(share, self.limit * _MIN_SHARE_FRACTION)
+
+    def consume(self, num_bytes, throttle=True):
+        """Accounts for `num_bytes` sent to the host, and sleeps as long as needed to stay within the share."""
+        self.bytes_transferred += num_bytes
+        self._window_bytes += num_bytes
+        if throttle and self.share:
+            ahead = self._window_bytes / self.share - (time.monotonic() - self._window_start)
+            if ahead > 0:
+                time.sleep(ahead)
+                self.throttled_seconds += ahead
+        if time.monotonic() - self._window_start >= _SHARE_REFRESH_INTERVAL:
+            self._refresh()
+
+    def wrap_callback(self, callback=None):
+        """
+        Returns a `callback(bytes_transferred, total_size)` for SFTP puts and HTTP uploads that throttles
+        the transfer before passing the progress on to `callback`.
+        """
+        last_position = [0]
+
+        def throttled_callback(bytes_transferred, total_size):
+            self.consume(bytes_transferred - last_position[0])
+            last_position[0] = bytes_transferred
+            if callback:
+                callback(bytes_transferred, total_size)
+        return throttled_callback
+
+    def describe(self):
+        """A short summary of the achieved rate and the share this job had, for the progress log."""
+        if not self.limit:
+            return f"{_format_rate(self.achieved_rate)}, no bandwidth limit"
+        return f"{_format_rate(self.achieved_rate)}, share {_format_rate(self.share)} of {_format_rate(self.limit)} to {self.host}"
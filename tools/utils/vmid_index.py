@@ -0,0 +1,237 @@
+import bisect
+import threading
+import time
+import uuid
+
+from tools.utils.state_files import locked_json_file
+
+# Proxmox accepts VM IDs in this range.
+VMID_MIN = 100
+VMID_MAX = 999999999
+
+_INDEX_REFRESH_SECONDS = 30
+_RESERVATION_TTL_SECONDS = 600
+# Reservations live in a file so that all gunicorn workers see the same state.
+_RESERVATIONS_FILE = "/tmp/fortitoolbox_vmid_reservations.json"
+
+
+class VmIdIntervalSet:
+    """A sorted set of VM IDs, stored as non-overlapping [start, end] intervals."""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, vmid):
+        idx = bisect.bisect_right(self._starts, vmid) - 1
+        return idx >= 0 and self._ends[idx] >= vmid
+
+    def lowest(self):
+        return self._starts[0] if self._starts else None
+
+    def highest(self):
+        return self._ends[-1] if self._ends else None
+
+    def interval_count(self):
+        return len(self._starts)
+
+    def copy(self):
+        clone = VmIdIntervalSet()
+        clone._starts = list(self._starts)
+        clone._ends = list(self._ends)
+        clone._count = self._count
+        return clone
+
+    def add(self, vmid):
+        idx = bisect.bisect_right(self._starts, vmid) - 1
+        if idx >= 0 and self._ends[idx] >= vmid:
+            return
+        joins_left = idx >= 0 and self._ends[idx] == vmid - 1
+        joins_right = idx + 1 < len(self._starts) and self._starts[idx + 1] == vmid + 1
+        if joins_left and joins_right:
+            self._ends[idx] = self._ends[idx + 1]
+            del self._starts[idx + 1]
+            del self._ends[idx + 1]
+        elif joins_left:
+            self._ends[idx] = vmid
+        elif joins_right:
+            self._starts[idx + 1] = vmid
+        else:
+            self._starts.insert(idx + 1, vmid)
+            self._ends.insert(idx + 1, vmid)
+        self._count += 1
+
+    def remove(self, vmid):
+        idx = bisect.bisect_right(self._starts, vmid) - 1
+        if idx < 0 or self._ends[idx] < vmid:
+            return
+        start, end = self._starts[idx], self._ends[idx]
+        if start == end:
+            del self._starts[idx]
+            del self._ends[idx]
+        elif vmid == start:
+            self._starts[idx] = vmid + 1
+        elif vmid == end:
+            self._ends[idx] = vmid - 1
+        else:
+            self._ends[idx] = vmid - 1
+            self._starts.insert(idx + 1, vmid + 1)
+            self._ends.insert(idx + 1, end)
+        self._count -= 1
+
+    def free_ids(self, count, range_start=VMID_MIN, range_end=VMID_MAX, exclude=()):
+        """Returns up to `count` IDs within [range_start, range_end] that are not in the set or in `exclude`."""
+        result = []
+        candidate = range_start
+        idx = bisect.bisect_right(self._starts, candidate) - 1
+        if idx >= 0 and self._ends[idx] >= candidate:
+            candidate = self._ends[idx] + 1
+        idx += 1
+
+        while len(result) < count and candidate <= range_end:
+            next_used = self._starts[idx] if idx < len(self._starts) else range_end + 1
+            while candidate < next_used and candidate <= range_end and len(result) < count:
+                if candidate not in exclude:
+                    result.append(candidate)
+                candidate += 1
+            if idx < len(self._starts) and candidate >= next_used:
+                candidate = self._ends[idx] + 1
+                idx += 1
+        return result
+
+
+_index = VmIdIntervalSet()
+_index_known_ids = set()
+_index_timestamp = 0
+# When each ID was marked as used locally, so a cluster listing fetched earlier does not remove it again.
+_index_marked_at = {}
+# Guards the in-memory index only. Never hold it across network calls or the reservations file lock:
+# with gevent, a greenlet that yields while holding it can deadlock the worker.
+_index_lock = threading.Lock()
+
+
+def refresh_vm_id_index(proxmox_api, force=False):
+    """
+    Brings the local VM ID index up to date with the cluster.
+    Only the differences since the last refresh are applied to the interval set.
+    """
+    global _index_timestamp
+    fetch_time = time.time()
+    with _index_lock:
+        if not force and (fetch_time - _index_timestamp) < _INDEX_REFRESH_SECONDS:
+            return _index
+
+    vms = proxmox_api.cluster.resources.get(type='vm')
+    current_ids = {int(vm['vmid']) for vm in vms}
+
+    with _index_lock:
+        for vmid in current_ids - _index_known_ids:
+            _index.add(vmid)
+        for vmid in _index_known_ids - current_ids:
+            if _index_marked_at.get(vmid, 0) < fetch_time:
+                _index.remove(vmid)
+                _index_known_ids.discard(vmid)
+        _index_known_ids.update(current_ids)
+        for vmid in [v for v, marked_at in _index_marked_at.items() if marked_at < fetch_time]:
+            del _index_marked_at[vmid]
+        _index_timestamp = max(_index_timestamp, fetch_time)
+        return _index
+
+
+def mark_vm_id_used(vmid):
+    """Records a freshly created VM in the index without waiting for the next refresh."""
+    with _index_lock:
+        vmid = int(vmid)
+        _index.add(vmid)
+        _index_known_ids.add(vmid)
+        _index_marked_at[vmid] = time.time()
+
+
+def is_vm_id_used(vmid):
+    with _index_lock:
+        return int(vmid) in _index
+
+
+def get_vm_id_summary():
+    """Returns summary data about the VM ID index, small enough to render on every page load."""
+    with _index_lock:
+        next_free = _index.free_ids(1)
+        return {
+            'count': len(_index),
+            'lowest': _index.lowest(),
+            'highest': _index.highest(),
+            'intervals': _index.interval_count(),
+            'next_free': next_free[0] if next_free else None,
+        }
+
+
+def _with_reservations(callback):
+    """Runs `callback(reservations)` while holding an exclusive lock on the reservations file."""
+    with locked_json_file(_RESERVATIONS_FILE) as reservations:
+        current_time = time.time()
+        for token in [t for t, r in reservations.items() if r['expires'] <= current_time]:
+            del reservations[token]
+        return callback(reservations)
+
+
+def reserve_vm_ids(proxmox_api, count=1, range_start=VMID_MIN, range_end=VMID_MAX, reserve=True):
+    """
+    Finds the next `count` free VM IDs in the given range.
+    When `reserve` is set, the IDs are held for a short time so parallel imports never pick the same ID.
+    Returns a (token, vm_ids) tuple; the token is None when nothing was reserved.
+    """
+    if range_start < VMID_MIN or range_end > VMID_MAX or range_start > range_end:
+        raise ValueError(f"VM ID range must be within {VMID_MIN}-{VMID_MAX}.")
+    if count < 1:
+        raise ValueError("At least one VM ID must be requested.")
+
+    refresh_vm_id_index(proxmox_api)
+    # A snapshot, so the index lock is not taken while the reservations file is locked.
+    with _index_lock:
+        index_snapshot = _index.copy()
+
+    def allocate(reservations):
+        reserved_ids = {vmid for r in reservations.values() for vmid in r['ids']}
+        vm_ids = index_snapshot.free_ids(count, range_start, range_end, exclude=reserved_ids)
+        if not reserve or not vm_ids:
+            return None, vm_ids
+        token = uuid.uuid4().hex
+        reservations[token] = {'ids': vm_ids, 'expires': time.time() + _RESERVATION_TTL_SECONDS}
+        return token, vm_ids
+
+    return _with_reservations(allocate)
+
+
+def claim_vm_id(vmid, token=None):
+    """
+    Reserves a specific VM ID, e.g. one the user typed in, under `token` (or a new token).
+    The ID replaces whatever the token held before. Returns the token, or None when
+    another reservation already holds the ID.
+    """
+    vmid = int(vmid)
+    if vmid < VMID_MIN or vmid > VMID_MAX:
+        raise ValueError(f"VM ID must be within {VMID_MIN}-{VMID_MAX}.")
+
+    def claim(reservations):
+        if any(vmid in r['ids'] for t, r in reservations.items() if t != token):
+            return None
+        claimed_token = token or uuid.uuid4().hex
+        reservations[claimed_token] = {'ids': [vmid], 'expires': time.time() + _RESERVATION_TTL_SECONDS}
+        return claimed_token
+
+    return _with_reservations(claim)
+
+
+def release_vm_id_reservation(token):
+    """Releases a reservation. Unknown or expired tokens are ignored."""
+    if not token:
+        return
+
+    def release(reservations):
+        reservations.pop(token, None)
+
+    _with_reservations(release)